@@ -0,0 +1,259 @@
+"""
+Нагрузочный прогон диалогов бота: синтетические обновления проходят через настоящий
+Dispatcher и роутеры (test_taking, test_creation, common) с временной базой и сессией
+бота без сети (fakebot). Результат сохраняется в JSON для сравнения между коммитами.
+
+    python benchmark.py --users 200
+    python benchmark.py --users 200 --compare benchmark_<commit>.json
+
+Каждый пользователь приходит по ссылке на тест, отвечает на четыре вопроса
+и создаёт свой тест. Обновления одного пользователя идут по очереди (следующее -
+после ответа бота), пользователи работают параллельно.
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import config
+from webhook_harness import percentile
+
+logger = logging.getLogger(__name__)
+
+# Сценарии: (название шага, текст сообщения). {test_id} подставляется при прохождении
+FLOWS: Dict[str, Sequence[Tuple[str, str]]] = {
+    'start': [('start', "/start")],
+    'take': [
+        ('deep_link', "/start {test_id}"),
+        ('answer', "Тестовый"),
+        ('answer', "160-179"),
+        ('answer', "Карие"),
+        ('answer', "Пауков"),
+    ],
+    'create': [
+        ('create', "Создать тест"),
+        ('answer', "Бенчмарк"),
+        ('answer', "180-199"),
+        ('answer', "Серые"),
+        ('answer', "Высоты"),
+    ],
+    'my_tests': [('my_tests', "Мой тест")],
+}
+
+# Полный сценарий нагрузочного пользователя
+USER_SCENARIO = ('take', 'create')
+
+
+class QueryCounter:
+    """Счётчик SQL-выражений по трассировке соединений (BEGIN и COMMIT тоже считаются)"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, statement: str):
+        with self._lock:
+            self.count += 1
+
+
+def latency_summary(latencies: Sequence[float]) -> Dict[str, float]:
+    """Число наблюдений, перцентили и максимум задержки в миллисекундах"""
+    return {
+        'count': len(latencies),
+        **{f'p{q}': round(percentile(latencies, q) * 1000, 3) for q in (50, 95, 99)},
+        'max': round(max(latencies, default=0.0) * 1000, 3),
+    }
+
+
+def git_commit() -> str:
+    """Текущий коммит (или 'unknown' вне репозитория)"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Benchmark:
+    """Окружение прогона: временная база, диспетчер, фейковый бот"""
+
+    def __init__(self, bot, dp, db):
+        self.bot = bot
+        self.dp = dp
+        self.db = db
+        self.queries = QueryCounter()
+        self._ids = itertools.count(1)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+
+    def make_update(self, user_id: int, text: str):
+        from aiogram.types import Chat, Message, Update, User
+        update_id = next(self._ids)
+        return Update(
+            update_id=update_id,
+            message=Message(
+                message_id=update_id,
+                date=datetime.datetime.now(),
+                chat=Chat(id=user_id, type='private'),
+                from_user=User(id=user_id, is_bot=False, first_name=f"User{user_id}"),
+                text=text,
+            ),
+        )
+
+    async def feed(self, user_id: int, step: str, text: str):
+        """Обработка одного обновления с замером времени"""
+        update = self.make_update(user_id, text)
+        started = time.perf_counter()
+        await self.dp.feed_update(self.bot, update)
+        self.latencies[step].append(time.perf_counter() - started)
+
+    async def run_flow(self, user_id: int, flow: str, test_id: str = "", think_time: float = 0.0):
+        for step, text in FLOWS[flow]:
+            await self.feed(user_id, step, text.format(test_id=test_id))
+            if think_time:
+                await asyncio.sleep(random.uniform(0, think_time))
+
+    async def queries_per_flow(self, test_id: str) -> Dict[str, int]:
+        """Число SQL-запросов каждого сценария (один пользователь, без параллельной нагрузки)"""
+        counts = {}
+        for index, flow in enumerate(FLOWS):
+            before = self.queries.count
+            await self.run_flow(10 ** 9 + index, flow, test_id)
+            counts[flow] = self.queries.count - before
+        return counts
+
+    async def run_users(self, users: int, test_ids: Sequence[str], think_time: float) -> float:
+        """Параллельный прогон пользователей, возвращает длительность в секундах"""
+        async def user(user_id: int):
+            await self.run_flow(user_id, 'start')
+            for flow in USER_SCENARIO:
+                await self.run_flow(user_id, flow, random.choice(test_ids), think_time)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user(user_id) for user_id in range(1, users + 1)))
+        return time.perf_counter() - started
+
+
+async def run_benchmark(users: int, seed_tests: int, think_time: float,
+                        bot_latency: float) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="benchmark_")
+    # Путь к базе нужно подменить до импорта database: путь по умолчанию читается при импорте
+    config.DATABASE_PATH = os.path.join(workdir, "benchmark.db")
+    # Синтетические пользователи отвечают быстрее живых - ограничение частоты не нужно
+    config.THROTTLE_RATE = 0
+    from bot import build_dispatcher, warm_up
+    from database import Database
+    from fakebot import make_fake_bot
+
+    db = Database()
+    await db.init_db()
+    bot = make_fake_bot(bot_latency)
+    dp = build_dispatcher(db)
+    await warm_up(bot, dp)
+    bench = Benchmark(bot, dp, db)
+    try:
+        # Тесты, по ссылкам на которые приходят пользователи
+        test_ids = []
+        for index in range(seed_tests):
+            test_id = f"bench_{index}"
+            await db.add_user(-index - 1)
+            await db.create_test(test_id, -index - 1, "Тестовый", "160-179", "Карие", "Пауков")
+            test_ids.append(test_id)
+
+        if db.pool is not None:
+            await db.pool.set_trace_callback(bench.queries)
+        queries_per_flow = await bench.queries_per_flow(test_ids[0])
+        bench.latencies.clear()
+        bot.session.calls.clear()
+
+        queries_before = bench.queries.count
+        elapsed = await bench.run_users(users, test_ids, think_time)
+        queries = bench.queries.count - queries_before
+        updates = sum(len(values) for values in bench.latencies.values())
+        all_latencies = [value for values in bench.latencies.values() for value in values]
+
+        return {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'params': {
+                'users': users, 'seed_tests': seed_tests,
+                'think_time': think_time, 'bot_latency': bot_latency,
+                'pool_size': config.DATABASE_POOL_SIZE,
+                'write_behind': config.WRITE_BEHIND_ENABLED,
+            },
+            'updates': updates,
+            'elapsed_seconds': round(elapsed, 3),
+            'updates_per_second': round(updates / elapsed, 1) if elapsed else 0.0,
+            'latency_ms': {
+                'all': latency_summary(all_latencies),
+                **{step: latency_summary(values) for step, values in bench.latencies.items()},
+            },
+            'queries_per_flow': queries_per_flow,
+            'queries_total': queries,
+            'queries_per_update': round(queries / updates, 2) if updates else 0.0,
+            'bot_calls': len(bot.session.calls),
+            'pool': db.pool.stats() if db.pool is not None else None,
+        }
+    finally:
+        await db.close()
+
+
+def compare_results(current: Dict, baseline: Dict) -> Dict[str, Dict]:
+    """Изменение пропускной способности и задержек относительно базового прогона"""
+    def change(now: float, before: float) -> Optional[float]:
+        return round((now - before) / before * 100, 1) if before else None
+
+    comparison = {
+        'updates_per_second': {
+            'baseline': baseline['updates_per_second'],
+            'current': current['updates_per_second'],
+            'change_percent': change(current['updates_per_second'], baseline['updates_per_second']),
+        },
+    }
+    for q in ('p50', 'p95', 'p99'):
+        now = current['latency_ms']['all'][q]
+        before = baseline['latency_ms']['all'][q]
+        comparison[f'latency_{q}_ms'] = {
+            'baseline': before, 'current': now, 'change_percent': change(now, before),
+        }
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон диалогов бота")
+    parser.add_argument("--users", type=int, default=100, help="Число параллельных пользователей")
+    parser.add_argument("--seed-tests", type=int, default=10,
+                        help="Сколько тестов создать заранее для ссылок")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="Максимальная пауза пользователя между сообщениями, секунды")
+    parser.add_argument("--bot-latency", type=float, default=0.0,
+                        help="Имитация задержки ответа Telegram API, секунды")
+    parser.add_argument("--output", help="Файл результата (по умолчанию benchmark_<commit>.json)")
+    parser.add_argument("--compare", help="Сравнить с сохранённым результатом")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    result = asyncio.run(run_benchmark(args.users, args.seed_tests, args.think_time, args.bot_latency))
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            result['comparison'] = compare_results(result, json.load(f))
+
+    output = args.output or f"benchmark_{result['commit']}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
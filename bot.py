@@ -3,14 +3,21 @@
 """
 import asyncio
 import logging
+from typing import Optional
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.enums import ParseMode
 
 import config
 from database import Database
 from handlers import common, test_creation, test_taking
+from metrics import setup_metrics, start_metrics_server
+from outbound import OutboundLimiter, setup_outbound
+from recorder import setup_recorder
 from scheduler import BroadcastScheduler
+from storage import SQLiteStorage
+from throttling import setup_throttling
+from webhook import run_webhook
+from workers import outbound_share, run_sharded
 
 # Настройка логирования
 logging.basicConfig(
@@ -20,17 +27,17 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def main():
-    """Основная функция запуска бота"""
-    
-    # Проверка токена
-    if not config.BOT_TOKEN:
-        logger.error("BOT_TOKEN не установлен! Создайте файл .env и добавьте BOT_TOKEN=your_token")
-        return
-    
-    # Инициализация бота и диспетчера
-    bot = Bot(token=config.BOT_TOKEN, parse_mode=ParseMode.HTML)
-    dp = Dispatcher(storage=MemoryStorage())
+def build_dispatcher(db: Database) -> Dispatcher:
+    """
+    Диспетчер со всеми роутерами. Роутер можно подключить только к одному
+    диспетчеру, поэтому в процессе он создаётся один раз
+    """
+    # Состояния диалогов хранятся в базе и переживают перезапуск
+    dp = Dispatcher(storage=SQLiteStorage(db))
+    # Обработчики получают базу аргументом db: один экземпляр на процесс
+    dp["db"] = db
+    # Флуд одного пользователя отсекается до чтения его состояния из базы
+    setup_throttling(dp)
     
     # Регистрация роутеров
     # Важно: обработчики состояний должны быть зарегистрированы перед общими обработчиками
@@ -38,25 +45,94 @@ async def main():
     dp.include_router(test_taking.router)
     dp.include_router(test_creation.router)
     dp.include_router(common.router)
+    return dp
+
+
+async def resolve_bot_username(bot: Bot) -> str:
+    """Имя бота для ссылок: config.BOT_USERNAME важнее ответа getMe"""
+    return config.BOT_USERNAME or (await bot.me()).username
+
+
+async def warm_up(bot: Bot, dp: Dispatcher, bot_username: Optional[str] = None):
+    """
+    Подготовка перед приёмом обновлений: имя бота для ссылок узнаётся один раз
+    (или передаётся готовым) и передаётся обработчикам как bot_username
+    """
+    dp["bot_username"] = bot_username or await resolve_bot_username(bot)
+    logger.info(f"Bot username: @{dp['bot_username']}")
+
+
+async def serve(bot: Bot, dp: Dispatcher):
+    """Приём и обработка обновлений в этом процессе"""
+    if config.BOT_MODE == "webhook":
+        await run_webhook(bot, dp)
+    else:
+        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+
+
+async def main():
+    """Основная функция запуска бота"""
+    
+    # Проверка токена
+    if not config.BOT_TOKEN:
+        logger.error("BOT_TOKEN не установлен! Создайте файл .env и добавьте BOT_TOKEN=your_token")
+        return
+    if config.BOT_MODE == "webhook" and not (config.WEBHOOK_URL and config.WEBHOOK_SECRET):
+        logger.error("Для режима webhook нужны WEBHOOK_URL и WEBHOOK_SECRET")
+        return
     
     # Инициализация базы данных
     db = Database()
     await db.init_db()
     logger.info("Database initialized")
     
+    # Инициализация бота и диспетчера
+    bot = Bot(token=config.BOT_TOKEN, parse_mode=ParseMode.HTML)
+    if config.BOT_WORKERS > 0:
+        # Ответы пользователям отправляют воркеры из своих долей лимита, здесь - только рассылка.
+        # Доли не пересекаются, поэтому рассылка не отнимает лимит у ответов и резерв не нужен
+        outbound = setup_outbound(
+            bot, OutboundLimiter(rate=outbound_share(config.BOT_WORKERS), bulk_reserve=0)
+        )
+    else:
+        # Все исходящие сообщения (ответы и рассылка) идут через общий лимит с приоритетами
+        outbound = setup_outbound(bot)
+    dp = build_dispatcher(db)
+    
+    # Метрики для Prometheus (в многопроцессном режиме обработчики меряют воркеры)
+    metrics_runner = None
+    if config.METRICS_PORT:
+        setup_metrics(bot, dp if config.BOT_WORKERS <= 0 else None, db, outbound)
+        metrics_runner = await start_metrics_server()
+    
     # Запуск планировщика рассылки
-    scheduler = BroadcastScheduler(bot)
+    scheduler = BroadcastScheduler(bot, db)
     scheduler.start()
     logger.info("Broadcast scheduler started")
     
     try:
         # Запуск бота
-        logger.info("Bot starting...")
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        logger.info(f"Bot starting in {config.BOT_MODE} mode...")
+        if config.BOT_WORKERS > 0:
+            # Обработчики работают в процессах-воркерах, здесь - приём обновлений и рассылка
+            await run_sharded(
+                bot, dp.resolve_used_update_types(), await resolve_bot_username(bot)
+            )
+        else:
+            if config.RECORD_UPDATES_PATH:
+                setup_recorder(dp)
+            await warm_up(bot, dp)
+            await serve(bot, dp)
     except Exception as e:
         logger.error(f"Error in main: {e}")
     finally:
         scheduler.shutdown()
+        await scheduler.release_leadership()
+        # Закрытие базы дописывает очередь отложенной записи
+        await db.close()
+        logger.info(f"Outbound stats: {outbound.stats()}")
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
         await bot.session.close()
 
 
@@ -0,0 +1,235 @@
+"""
+Движок массовой рассылки
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Deque, List, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+    TelegramRetryAfter, TelegramServerError
+)
+
+import config
+from database import Database
+from migrations import BROADCAST_SLOTS
+from outbound import Priority, has_outbound_limiter, send_priority
+
+logger = logging.getLogger(__name__)
+
+# Ответы Telegram, после которых пользователю больше нет смысла писать
+PERMANENT_BAD_REQUEST_ERRORS = (
+    "chat not found",
+    "user not found",
+    "user is deactivated",
+)
+
+
+def is_unreachable(error: Exception) -> bool:
+    """Постоянная ошибка доставки: бот заблокирован, чат удалён или аккаунт деактивирован"""
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    if isinstance(error, TelegramBadRequest):
+        message = error.message.lower()
+        return any(reason in message for reason in PERMANENT_BAD_REQUEST_ERRORS)
+    return False
+
+
+async def smoothed_user_stream(db: Database, started_at: float, window: float,
+                               after_user_id: int = 0) -> AsyncIterator[int]:
+    """
+    Подписчики по слотам рассылки (user_id % BROADCAST_SLOTS) с выдачей слота s
+    не раньше started_at + s * window / BROADCAST_SLOTS. Каждый получает сообщение
+    один раз за период, а отправка идёт равномерно, а не одним всплеском.
+    """
+    slot_duration = window / BROADCAST_SLOTS
+    # Продолжение с курсора: слот курсора однозначно определяется по user_id
+    first_slot = after_user_id % BROADCAST_SLOTS
+    for slot in range(first_slot, BROADCAST_SLOTS):
+        delay = started_at + slot * slot_duration - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        after = after_user_id if slot == first_slot else 0
+        async for user_id in db.iter_slot_users(slot, after_user_id=after):
+            yield user_id
+
+
+@dataclass
+class BroadcastStats:
+    """Статистика одного прогона рассылки"""
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    unreachable: int = 0
+    errors: Counter = field(default_factory=Counter)
+    # Число отправок по секундам от начала рассылки
+    sent_per_second: Counter = field(default_factory=Counter)
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: Optional[float] = None
+
+    def record_sent(self):
+        """Учёт успешной отправки"""
+        self.sent += 1
+        self.sent_per_second[int(time.monotonic() - self.started_at)] += 1
+
+    @property
+    def peak_rate(self) -> int:
+        """Максимальное число отправок за одну секунду"""
+        return max(self.sent_per_second.values(), default=0)
+
+    def rate_series(self, bucket_seconds: int = 60) -> List[float]:
+        """Средняя скорость отправки (в секунду) по интервалам длиной bucket_seconds"""
+        buckets = int(self.elapsed) // bucket_seconds + 1
+        series = [0.0] * buckets
+        for second, count in self.sent_per_second.items():
+            series[min(second // bucket_seconds, buckets - 1)] += count / bucket_seconds
+        return series
+
+    @property
+    def elapsed(self) -> float:
+        """Длительность рассылки в секундах"""
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def rate(self) -> float:
+        """Средняя скорость отправки (сообщений в секунду)"""
+        elapsed = self.elapsed
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+
+class BroadcastEngine:
+    """
+    Рассылка с ограниченным числом одновременных отправок.
+    Скорость ограничивает общий слой отправки (outbound): сообщения рассылки
+    идут с приоритетом BULK и не задерживают ответы пользователям.
+    """
+
+    def __init__(self, bot: Bot,
+                 concurrency: int = config.BROADCAST_CONCURRENCY,
+                 max_retries: int = config.BROADCAST_MAX_RETRIES,
+                 on_unreachable: Optional[Callable[[List[int]], Awaitable[None]]] = None,
+                 prune_batch_size: int = config.BROADCAST_PRUNE_BATCH_SIZE):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        # Недоступные пользователи копятся в буфере и передаются в on_unreachable пачками
+        self.on_unreachable = on_unreachable
+        self.prune_batch_size = prune_batch_size
+        self._unreachable: List[int] = []
+
+    async def run(self, user_ids: AsyncIterable[int], text: str,
+                  checkpoint: Optional[Callable[[int, BroadcastStats], Awaitable[None]]] = None,
+                  checkpoint_every: int = config.BROADCAST_CHECKPOINT_EVERY) -> BroadcastStats:
+        """
+        Отправка текста всем пользователям из потока user_ids (по возрастанию ID).
+        Каждые checkpoint_every отправок вызывается checkpoint(cursor, stats), где
+        cursor - наибольший ID, до которого включительно все пользователи обработаны.
+        """
+        if not has_outbound_limiter(self.bot):
+            logger.warning("Outbound limiter is not set up, broadcast is not rate limited")
+        stats = BroadcastStats()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        # Выданные в работу ID по порядку и уже обработанные из них:
+        # курсор сдвигается только по непрерывному обработанному префиксу
+        dispatched: Deque[int] = deque()
+        processed: Set[int] = set()
+        progress = {'cursor': None, 'since_checkpoint': 0}
+        checkpoint_lock = asyncio.Lock()
+
+        async def save_checkpoint():
+            async with checkpoint_lock:
+                while dispatched and dispatched[0] in processed:
+                    processed.discard(dispatched[0])
+                    progress['cursor'] = dispatched.popleft()
+                progress['since_checkpoint'] = 0
+                if checkpoint is None or progress['cursor'] is None:
+                    return
+                # Отписки сбрасываем раньше курсора, чтобы не потерять их при рестарте
+                await self._flush_unreachable()
+                try:
+                    await checkpoint(progress['cursor'], stats)
+                except Exception as e:
+                    logger.error(f"Error saving broadcast checkpoint: {e}")
+
+        async def worker():
+            send_priority.set(Priority.BULK)
+            while True:
+                user_id = await queue.get()
+                try:
+                    if user_id is None:
+                        return
+                    await self._send(user_id, text, stats)
+                    processed.add(user_id)
+                    progress['since_checkpoint'] += 1
+                    if progress['since_checkpoint'] >= checkpoint_every:
+                        await save_checkpoint()
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            # Очередь ограничена, поэтому поток читается не быстрее, чем идёт отправка
+            async for user_id in user_ids:
+                dispatched.append(user_id)
+                await queue.put(user_id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await save_checkpoint()
+            await self._flush_unreachable()
+            stats.finished_at = time.monotonic()
+        return stats
+
+    async def _mark_unreachable(self, user_id: int):
+        """Запоминание недоступного пользователя, сброс буфера при заполнении"""
+        self._unreachable.append(user_id)
+        if len(self._unreachable) >= self.prune_batch_size:
+            await self._flush_unreachable()
+
+    async def _flush_unreachable(self):
+        """Передача накопленных недоступных пользователей в on_unreachable"""
+        if not self._unreachable or self.on_unreachable is None:
+            return
+        batch, self._unreachable = self._unreachable, []
+        try:
+            await self.on_unreachable(batch)
+        except Exception as e:
+            logger.error(f"Error pruning {len(batch)} unreachable users: {e}")
+
+    async def _send(self, user_id: int, text: str, stats: BroadcastStats):
+        """Отправка одному пользователю с повторами при флуд-контроле и сбоях сети"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.bot.send_message(user_id, text, reply_markup=None)
+                stats.record_sent()
+                return
+            except TelegramRetryAfter as e:
+                # Паузу для всех отправок выставляет общий слой отправки, и повтор
+                # дождётся её окончания; без него ждём здесь сами
+                if not has_outbound_limiter(self.bot):
+                    await asyncio.sleep(e.retry_after)
+                last_error = e
+            except (TelegramNetworkError, TelegramServerError) as e:
+                await asyncio.sleep(min(2 ** attempt, 30))
+                last_error = e
+            except Exception as e:
+                if is_unreachable(e):
+                    stats.unreachable += 1
+                    stats.errors[type(e).__name__] += 1
+                    await self._mark_unreachable(user_id)
+                    return
+                last_error = e
+                break
+            if attempt < self.max_retries:
+                stats.retries += 1
+
+        logger.error(f"Error sending message to {user_id}: {last_error}")
+        stats.failed += 1
+        stats.errors[type(last_error).__name__] += 1
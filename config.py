@@ -15,9 +15,167 @@ BOT_USERNAME = os.getenv("BOT_USERNAME", "")
 # Путь к базе данных
 DATABASE_PATH = "friends_test_bot.db"
 
+# Количество долгоживущих соединений с базой (0 - отдельное соединение на каждый запрос)
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "4"))
+
+# Отложенная запись регистраций и ответов на тесты групповыми коммитами
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "0") == "1"
+
+# Пачка записывается, когда в ней столько операций...
+WRITE_BEHIND_MAX_BATCH = 200
+
+# ...или прошло столько миллисекунд с первой операции пачки
+WRITE_BEHIND_MAX_DELAY_MS = 50
+
+# Максимум операций в очереди, дальше запись ждёт освобождения места
+WRITE_BEHIND_MAX_PENDING = 10000
+
+# Ждать ли коммита своей записи (иначе при падении процесса очередь теряется)
+WRITE_BEHIND_DURABLE = os.getenv("WRITE_BEHIND_DURABLE", "1") == "1"
+
+# Через сколько секунд без ответа незаконченный диалог (создание или прохождение теста)
+# считается брошенным
+FSM_STATE_TTL = 24 * 3600
+
+# Сколько состояний FSM держать в памяти
+FSM_CACHE_SIZE = 50000
+
+# Сколько реплик бота принимают обновления за балансировщиком нагрузки. Одна реплика
+# (в том числе с воркерами BOT_WORKERS) сама обрабатывает все сообщения пользователя,
+# при нескольких сообщения одного пользователя попадают в разные процессы
+BOT_REPLICAS = int(os.getenv("BOT_REPLICAS", "1"))
+
+# Сколько секунд состояние FSM из кэша считается актуальным (0 - без кэша).
+# При нескольких репликах кэш по умолчанию выключен: его заполняет и другая реплика
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "3600" if BOT_REPLICAS <= 1 else "0"))
+
+# Как часто (в секундах) удалять брошенные диалоги из базы
+FSM_PURGE_INTERVAL = 3600
+
+# Сколько тестов держать в памяти (LRU-кэш для прохождения популярных тестов)
+TEST_CACHE_SIZE = 10000
+
+# Сколько друзей показывать в рейтинге теста
+LEADERBOARD_SIZE = 10
+
+# Сколько тестов показывать на одной странице "Мой тест"
+MY_TESTS_PAGE_SIZE = 5
+
+# Размер кэша подготовленных выражений на одно соединение
+DATABASE_STATEMENT_CACHE_SIZE = 256
+
+# Размер страничного кэша SQLite на одно соединение (в килобайтах)
+DATABASE_CACHE_SIZE_KB = 8192
+
+# Сколько ждать снятия блокировки базы другим соединением (в миллисекундах)
+DATABASE_BUSY_TIMEOUT_MS = 5000
+
 # Интервал рассылки в секундах (1 час = 3600 секунд)
 BROADCAST_INTERVAL = 3600
 
+# Новая рассылка не начинается раньше, чем через столько секунд после начала предыдущей
+# (на любой реплике). Запас в минуту - на расхождение таймеров и задержку старта задания
+BROADCAST_MIN_GAP = BROADCAST_INTERVAL - 60
+
+# Режим рассылки: "burst" - всем подписчикам сразу, "smoothed" - равномерно в течение
+# интервала по слотам (слот пользователя определяется его user_id)
+BROADCAST_MODE = os.getenv("BROADCAST_MODE", "burst")
+
+# Доля интервала, за которую равномерная рассылка должна обойти все слоты
+BROADCAST_SMOOTHING_WINDOW = 0.9
+
 # Текст рассылки
 BROADCAST_MESSAGE = "Хочешь проверить, кто твой настоящий друг? Создай тест дружбы прямо сейчас 👇"
 
+
+# Общий лимит исходящих сообщений бота (Telegram допускает около 30 сообщений в секунду)
+OUTBOUND_RATE_LIMIT = 28
+
+# Сколько токенов лимита недоступно рассылке - запас для ответов пользователям
+OUTBOUND_BULK_RESERVE = 5
+
+# Сколько отправок рассылки может выполняться одновременно
+BROADCAST_CONCURRENCY = 10
+
+# Сколько подписчиков читать из базы за один запрос при рассылке
+BROADCAST_CHUNK_SIZE = 500
+
+# Сколько раз повторять отправку при флуд-контроле или сбое сети
+BROADCAST_MAX_RETRIES = 3
+
+# По сколько недоступных пользователей отписывать одним запросом
+BROADCAST_PRUNE_BATCH_SIZE = 100
+
+# Как часто (в отправках) сохранять прогресс рассылки для продолжения после перезапуска
+BROADCAST_CHECKPOINT_EVERY = 200
+
+# Аренда лидерства: рассылку выполняет только реплика, владеющая арендой.
+# Аренда продлевается каждые LEADER_HEARTBEAT_INTERVAL секунд и истекает через LEADER_LEASE_TTL
+LEADER_LEASE_TTL = 10
+LEADER_HEARTBEAT_INTERVAL = 3
+
+
+# Способ получения обновлений: "polling" (long polling) или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Публичный адрес вебхука (например, https://example.com) и путь, на который Telegram шлёт обновления
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = "/webhook"
+
+# Секрет, который Telegram передаёт в заголовке X-Telegram-Bot-Api-Secret-Token
+# (1-256 символов: A-Z, a-z, 0-9, _ и -)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Адрес и порт HTTP-сервера вебхука
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+
+# Сколько обновлений обрабатывать одновременно
+WEBHOOK_MAX_CONCURRENT_UPDATES = 100
+
+# Сколько принятых, но ещё не обработанных обновлений допустимо - дальше сервер
+# отвечает 503, и Telegram повторит доставку позже
+WEBHOOK_MAX_PENDING_UPDATES = 1000
+
+
+# Число процессов-воркеров с обработчиками (0 - всё в одном процессе).
+# Родительский процесс принимает обновления и раскладывает их по воркерам по user_id
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "0"))
+
+# Сколько обновлений может ждать в очереди одного воркера - дальше приём притормаживает
+# (в режиме webhook - отвечает 503)
+WORKER_QUEUE_SIZE = 1000
+
+# Сколько обновлений воркер обрабатывает одновременно и сколько держит принятыми
+WORKER_MAX_CONCURRENT_UPDATES = 100
+WORKER_MAX_PENDING_UPDATES = 500
+
+# Как часто (в секундах) воркеры присылают метрики и родитель пишет их в лог
+WORKER_STATS_INTERVAL = 60
+
+
+# Порт HTTP-эндпоинта метрик в формате Prometheus (0 - метрики не отдаются).
+# В многопроцессном режиме воркер N отдаёт свои метрики на METRICS_PORT + 1 + N
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+
+# Запись входящих обновлений (обезличенных) для воспроизведения: путь к файлу, пусто - выключено.
+# В многопроцессном режиме воркер N пишет в <путь>.N
+RECORD_UPDATES_PATH = os.getenv("RECORD_UPDATES_PATH", "")
+
+# Ключ обезличивания идентификаторов и текста. Пустой - случайный на каждый запуск
+# (тогда один и тот же пользователь в разных запусках получит разные идентификаторы)
+RECORD_SALT = os.getenv("RECORD_SALT", "")
+
+
+# Ограничение частоты входящих обновлений от одного пользователя: в среднем не больше
+# THROTTLE_RATE в секунду, подряд - до THROTTLE_BURST. 0 - без ограничения
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))
+THROTTLE_BURST = 5
+
+# Сколько пользователей помнить одновременно (при переполнении забываются давно неактивные)
+THROTTLE_TABLE_SIZE = 100000
+
+# Ответ на первое отброшенное обновление серии
+THROTTLE_MESSAGE = "⏳ Слишком много сообщений подряд. Подожди пару секунд и попробуй снова."
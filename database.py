@@ -1,164 +1,725 @@
 """
 Модуль для работы с базой данных
 """
+import asyncio
+import logging
+import time
 import aiosqlite
-from typing import Optional, List, Dict
+from contextlib import asynccontextmanager
+from itertools import groupby
+from types import MappingProxyType
+from typing import Optional, List, Dict, AsyncIterator, Callable, Mapping, Sequence, Tuple
 from datetime import datetime
 import config
+from cache import LRUCache
+from migrations import BROADCAST_SLOTS, apply_migrations
+from scoring import TOTAL_QUESTIONS, Score, pack_answers, score_answer, score_batch, unpack_answers
+
+logger = logging.getLogger(__name__)
+
+# Настройки, применяемые к каждому соединению пула
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    f"PRAGMA cache_size = -{config.DATABASE_CACHE_SIZE_KB}",
+    f"PRAGMA busy_timeout = {config.DATABASE_BUSY_TIMEOUT_MS}",
+)
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений с SQLite"""
+
+    def __init__(self, db_path: str, size: int = config.DATABASE_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._connections: List[aiosqlite.Connection] = []
+        self._idle: asyncio.Queue = asyncio.Queue()
+        # Статистика ожидания свободного соединения
+        self.acquire_count = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    async def open(self):
+        """Открытие соединений и применение настроек"""
+        for _ in range(self.size):
+            conn = await aiosqlite.connect(
+                self.db_path,
+                cached_statements=config.DATABASE_STATEMENT_CACHE_SIZE
+            )
+            conn.row_factory = aiosqlite.Row
+            for pragma in CONNECTION_PRAGMAS:
+                await conn.execute(pragma)
+            self._connections.append(conn)
+            self._idle.put_nowait(conn)
+
+    async def close(self):
+        """Закрытие всех соединений пула"""
+        for conn in self._connections:
+            await conn.close()
+        self._connections.clear()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Получение соединения из пула на время блока"""
+        started = time.perf_counter()
+        conn = await self._idle.get()
+        waited = time.perf_counter() - started
+        self.acquire_count += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+        try:
+            yield conn
+        except BaseException:
+            # Не возвращаем в пул соединение с незавершённой транзакцией
+            try:
+                await conn.rollback()
+            except Exception as e:
+                logger.error(f"Error rolling back pooled connection: {e}")
+            raise
+        finally:
+            self._idle.put_nowait(conn)
+
+    async def set_trace_callback(self, callback: Optional[Callable[[str], None]]):
+        """Трассировка SQL на всех соединениях пула (callback вызывается в потоке соединения)"""
+        for conn in self._connections:
+            await conn.set_trace_callback(callback)
+
+    def stats(self) -> Dict:
+        """Статистика пула для подбора его размера"""
+        return {
+            'size': self.size,
+            'idle': self._idle.qsize(),
+            'acquire_count': self.acquire_count,
+            'wait_time_avg_ms': (
+                self.wait_time_total / self.acquire_count * 1000 if self.acquire_count else 0.0
+            ),
+            'wait_time_max_ms': self.wait_time_max * 1000,
+        }
+
+
+# Запись для отложенной очереди: SQL-выражение и его параметры
+Statement = Tuple[str, Sequence]
+
+
+class WriteBehindQueue:
+    """
+    Отложенная запись: мелкие вставки собираются в групповые коммиты.
+    Пачка пишется, когда набралось max_batch операций или прошло max_delay_ms
+    с первой операции пачки. При durable=True вызывающий ждёт коммита своей операции,
+    иначе - только постановки в очередь (при падении процесса очередь теряется).
+    """
+
+    def __init__(self, database: 'Database',
+                 max_batch: int = config.WRITE_BEHIND_MAX_BATCH,
+                 max_delay_ms: int = config.WRITE_BEHIND_MAX_DELAY_MS,
+                 max_pending: int = config.WRITE_BEHIND_MAX_PENDING,
+                 durable: bool = config.WRITE_BEHIND_DURABLE):
+        self.database = database
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.durable = durable
+        # Ограниченная очередь: при заполнении submit ждёт (обратное давление)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.written = 0
+        self.lost = 0
+
+    def start(self):
+        """Запуск фоновой записи"""
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, statements: List[Statement], wait: bool = False):
+        """
+        Постановка в очередь операций, которые должны записаться одной транзакцией.
+        wait=True - дождаться коммита, даже если очередь не durable
+        """
+        future = asyncio.get_running_loop().create_future() if self.durable or wait else None
+        await self._queue.put((statements, future))
+        if future is not None:
+            await future
+
+    async def close(self):
+        """Запись всего, что накопилось в очереди, и остановка"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            stop = False
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            await self._write(batch)
+            if stop:
+                return
+
+    async def _write(self, batch: List[Tuple[List[Statement], Optional[asyncio.Future]]]):
+        """Запись пачки одной транзакцией, при ошибке - по одной операции"""
+        statements = [statement for unit, _ in batch for statement in unit]
+        try:
+            async with self.database.connection() as db:
+                # Подряд идущие одинаковые выражения выполняем одним executemany
+                for sql, group in groupby(statements, key=lambda statement: statement[0]):
+                    await db.executemany(sql, [params for _, params in group])
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Error writing batch of {len(batch)}, retrying one by one: {e}")
+            for unit, future in batch:
+                await self._write_unit(unit, future)
+            return
+        
+        self.batches += 1
+        self.written += len(batch)
+        for _, future in batch:
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def _write_unit(self, unit: List[Statement], future: Optional[asyncio.Future]):
+        try:
+            async with self.database.connection() as db:
+                for sql, params in unit:
+                    await db.execute(sql, params)
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Error writing deferred operation: {e}")
+            self.lost += 1
+            if future is not None and not future.done():
+                future.set_exception(e)
+            return
+        self.written += 1
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def stats(self) -> Dict:
+        """Статистика очереди"""
+        return {
+            'pending': self._queue.qsize(),
+            'batches': self.batches,
+            'written': self.written,
+            'lost': self.lost,
+            'avg_batch': self.written / self.batches if self.batches else 0.0,
+        }
 
 
 class Database:
     """Класс для работы с базой данных SQLite"""
+
+    # Пулы общие для всех экземпляров, работающих с одним файлом базы
+    _pools: Dict[str, ConnectionPool] = {}
+    # Тесты не меняются после создания, поэтому их можно держать в памяти
+    _test_caches: Dict[str, LRUCache] = {}
+    # Очереди отложенной записи (при WRITE_BEHIND_ENABLED)
+    _write_queues: Dict[str, WriteBehindQueue] = {}
     
     def __init__(self, db_path: str = config.DATABASE_PATH):
         self.db_path = db_path
+
+    @property
+    def pool(self) -> Optional[ConnectionPool]:
+        """Открытый пул соединений для этой базы (если есть)"""
+        return self._pools.get(self.db_path)
+
+    @property
+    def write_queue(self) -> Optional[WriteBehindQueue]:
+        """Очередь отложенной записи для этой базы (если включена)"""
+        return self._write_queues.get(self.db_path)
+
+    @property
+    def test_cache(self) -> LRUCache:
+        """Общий для экземпляров кэш тестов этой базы"""
+        cache = self._test_caches.get(self.db_path)
+        if cache is None:
+            cache = self._test_caches[self.db_path] = LRUCache(config.TEST_CACHE_SIZE)
+        return cache
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Соединение из пула, либо отдельное соединение, если пул не открыт"""
+        pool = self.pool
+        if pool is not None:
+            async with pool.acquire() as db:
+                yield db
+        else:
+            async with aiosqlite.connect(self.db_path) as db:
+                db.row_factory = aiosqlite.Row
+                yield db
+
+    async def open_pool(self):
+        """Открытие пула соединений (при DATABASE_POOL_SIZE > 0)"""
+        if config.DATABASE_POOL_SIZE <= 0 or self.db_path in self._pools:
+            return
+        pool = ConnectionPool(self.db_path, config.DATABASE_POOL_SIZE)
+        await pool.open()
+        self._pools[self.db_path] = pool
+        logger.info(f"Database pool opened: {pool.size} connections")
+
+    async def close(self):
+        """Запись отложенных операций и закрытие пула соединений"""
+        queue = self._write_queues.pop(self.db_path, None)
+        if queue is not None:
+            await queue.close()
+            logger.info(f"Write-behind stats: {queue.stats()}")
+        pool = self._pools.pop(self.db_path, None)
+        if pool is not None:
+            logger.info(f"Database pool stats: {pool.stats()}")
+            logger.info(f"Test cache stats: {self.test_cache.stats()}")
+            await pool.close()
     
     async def init_db(self):
-        """Инициализация базы данных - создание таблиц"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Таблица пользователей
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_subscribed INTEGER DEFAULT 1
-                )
-            """)
-            
-            # Таблица тестов
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS tests (
-                    test_id TEXT PRIMARY KEY,
-                    creator_id INTEGER NOT NULL,
-                    name TEXT NOT NULL,
-                    height_range TEXT,
-                    eye_color TEXT,
-                    fear TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (creator_id) REFERENCES users(user_id)
-                )
-            """)
-            
-            # Таблица ответов пользователей на тесты
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS test_answers (
-                    answer_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    test_id TEXT NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    name TEXT,
-                    height_range TEXT,
-                    eye_color TEXT,
-                    fear TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (test_id) REFERENCES tests(test_id),
-                    FOREIGN KEY (user_id) REFERENCES users(user_id)
-                )
-            """)
-            
+        """Инициализация базы данных - открытие пула и применение миграций"""
+        await self.open_pool()
+        async with self.connection() as db:
+            version = await apply_migrations(db)
+        logger.info(f"Database schema version: {version}")
+        
+        if config.WRITE_BEHIND_ENABLED and self.db_path not in self._write_queues:
+            queue = WriteBehindQueue(self)
+            queue.start()
+            self._write_queues[self.db_path] = queue
+    
+    async def _execute_write(self, statements: List[Statement], wait: bool = False):
+        """
+        Запись операций одной транзакцией - сразу или через очередь отложенной записи.
+        wait=True - вернуться только после коммита (запись сразу же читают из базы)
+        """
+        queue = self.write_queue
+        if queue is not None:
+            await queue.submit(statements, wait=wait)
+            return
+        async with self.connection() as db:
+            for sql, params in statements:
+                await db.execute(sql, params)
             await db.commit()
     
     async def add_user(self, user_id: int, username: Optional[str] = None, 
                       first_name: Optional[str] = None):
-        """Добавление или обновление пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT OR REPLACE INTO users (user_id, username, first_name, is_subscribed)
-                VALUES (?, ?, ?, 1)
-            """, (user_id, username, first_name))
-            await db.commit()
+        """Добавление или обновление пользователя (флаг подписки не меняется)"""
+        await self._execute_write([("""
+            INSERT INTO users (user_id, username, first_name)
+            VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                username = excluded.username,
+                first_name = excluded.first_name
+        """, (user_id, username, first_name))])
     
     async def create_test(self, test_id: str, creator_id: int, name: str, 
                          height_range: str, eye_color: str, fear: str) -> bool:
         """Создание нового теста"""
-        async with aiosqlite.connect(self.db_path) as db:
+        answers = {'height_range': height_range, 'eye_color': eye_color, 'fear': fear}
+        async with self.connection() as db:
             try:
                 await db.execute("""
-                    INSERT INTO tests (test_id, creator_id, name, height_range, eye_color, fear)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                """, (test_id, creator_id, name, height_range, eye_color, fear))
+                    INSERT INTO tests (test_id, creator_id, name, answers_packed)
+                    VALUES (?, ?, ?, ?)
+                """, (test_id, creator_id, name, pack_answers(answers)))
                 await db.commit()
                 return True
             except Exception as e:
+                await db.rollback()
                 print(f"Error creating test: {e}")
                 return False
     
-    async def get_test(self, test_id: str) -> Optional[Dict]:
-        """Получение теста по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+    async def get_test(self, test_id: str) -> Optional[Mapping]:
+        """Получение теста по ID (неизменяемый словарь, повторные чтения - из кэша)"""
+        test = self.test_cache.get(test_id)
+        if test is not None:
+            return test
+        
+        async with self.connection() as db:
             async with db.execute("""
                 SELECT * FROM tests WHERE test_id = ?
             """, (test_id,)) as cursor:
                 row = await cursor.fetchone()
-                if row:
-                    return dict(row)
-                return None
-    
-    async def get_user_tests(self, user_id: int) -> List[Dict]:
-        """Получение всех тестов пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT * FROM tests WHERE creator_id = ? ORDER BY created_at DESC
-            """, (user_id,)) as cursor:
+                if not row:
+                    return None
+        
+        # Ответы с выбором хранятся упакованными, наружу отдаём и коды, и варианты
+        test = dict(row)
+        test.update(unpack_answers(test['answers_packed']))
+        test = MappingProxyType(test)
+        self.test_cache.put(test_id, test)
+        return test
+    
+    async def get_user_tests_page(self, user_id: int, limit: int = config.MY_TESTS_PAGE_SIZE,
+                                  after_test_id: Optional[str] = None,
+                                  before_test_id: Optional[str] = None) -> Tuple[List[Dict], bool]:
+        """
+        Страница тестов пользователя, от новых к старым. Ключ страницы - (created_at, test_id):
+        after_test_id - тесты старше указанного, before_test_id - новее него.
+        Возвращает тесты и признак, что в том же направлении есть ещё
+        """
+        if before_test_id is not None:
+            condition, order, cursor_test_id = ">", "ASC", before_test_id
+        else:
+            condition, order, cursor_test_id = "<", "DESC", after_test_id
+        
+        params = [user_id]
+        cursor_filter = ""
+        if cursor_test_id is not None:
+            cursor_filter = f"""
+                AND (created_at, test_id) {condition}
+                    (SELECT created_at, test_id FROM tests WHERE test_id = ?)
+            """
+            params.append(cursor_test_id)
+        
+        async with self.connection() as db:
+            async with db.execute(f"""
+                SELECT * FROM tests WHERE creator_id = ? {cursor_filter}
+                ORDER BY created_at {order}, test_id {order} LIMIT ?
+            """, (*params, limit + 1)) as cursor:
                 rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        
+        tests = [dict(row) for row in rows[:limit]]
+        if before_test_id is not None:
+            tests.reverse()
+        return tests, len(rows) > limit
     
     async def save_test_answer(self, test_id: str, user_id: int, name: str,
-                               height_range: str, eye_color: str, fear: str):
-        """Сохранение ответа пользователя на тест"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT INTO test_answers (test_id, user_id, name, height_range, eye_color, fear)
+                               height_range: str, eye_color: str, fear: str,
+                               score: Optional[Score] = None):
+        """Сохранение ответа пользователя на тест вместе с результатом (одной записью)"""
+        answer = {'name': name, 'height_range': height_range, 'eye_color': eye_color, 'fear': fear}
+        answers_packed = pack_answers(answer)
+        if score is None:
+            test = await self.get_test(test_id)
+            score = score_answer(test, answer) if test else Score(0, 0, 0)
+        
+        # Агрегаты теста обновляются в той же транзакции, что и вставка ответа
+        histogram = tuple(int(score.matches == matches) for matches in range(TOTAL_QUESTIONS + 1))
+        await self._execute_write([
+            ("""
+                INSERT INTO test_answers (test_id, user_id, name, answers_packed, matches, percentage)
                 VALUES (?, ?, ?, ?, ?, ?)
-            """, (test_id, user_id, name, height_range, eye_color, fear))
-            await db.commit()
+            """, (test_id, user_id, name, answers_packed, score.matches, score.percentage)),
+            ("""
+                INSERT INTO test_stats (test_id, completions, score_sum, best_score,
+                                        matches_0, matches_1, matches_2, matches_3, matches_4)
+                VALUES (?, 1, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (test_id) DO UPDATE SET
+                    completions = completions + 1,
+                    score_sum = score_sum + excluded.score_sum,
+                    best_score = MAX(best_score, excluded.best_score),
+                    matches_0 = matches_0 + excluded.matches_0,
+                    matches_1 = matches_1 + excluded.matches_1,
+                    matches_2 = matches_2 + excluded.matches_2,
+                    matches_3 = matches_3 + excluded.matches_3,
+                    matches_4 = matches_4 + excluded.matches_4
+            """, (test_id, score.percentage, score.percentage) + histogram),
+        ])
     
-    async def calculate_match_percentage(self, test_id: str, user_id: int) -> int:
-        """Подсчет процента совпадений ответов с оригинальным тестом"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Получаем оригинальный тест
-            test = await self.get_test(test_id)
-            if not test:
-                return 0
-            
-            # Получаем ответ пользователя
-            db.row_factory = aiosqlite.Row
+    async def get_test_leaderboard(self, test_id: str,
+                                   limit: int = config.LEADERBOARD_SIZE) -> List[Dict]:
+        """
+        Лучшие друзья теста: лучший результат каждого друга, при равенстве выше тот,
+        кто набрал его раньше. Ответы читаются по индексу уже в порядке рейтинга,
+        поэтому первый ответ друга - его лучший, а чтение останавливается на limit друзьях
+        """
+        leaders = []
+        seen = set()
+        async with self.connection() as db:
             async with db.execute("""
-                SELECT * FROM test_answers 
-                WHERE test_id = ? AND user_id = ? 
-                ORDER BY created_at DESC LIMIT 1
-            """, (test_id, user_id)) as cursor:
-                answer_row = await cursor.fetchone()
-                if not answer_row:
-                    return 0
-                
-                answer = dict(answer_row)
+                SELECT a.user_id, a.matches, a.percentage, a.created_at,
+                    u.first_name, u.username
+                FROM test_answers a LEFT JOIN users u ON u.user_id = a.user_id
+                WHERE a.test_id = ?
+                ORDER BY a.percentage DESC, a.created_at
+            """, (test_id,)) as cursor:
+                while len(leaders) < limit:
+                    rows = await cursor.fetchmany(limit)
+                    if not rows:
+                        break
+                    for row in rows:
+                        if row['user_id'] in seen:
+                            continue
+                        seen.add(row['user_id'])
+                        leaders.append(dict(row))
+                        if len(leaders) == limit:
+                            break
+        return leaders
+    
+    async def iter_subscribed_users(self, chunk_size: int = config.BROADCAST_CHUNK_SIZE,
+                                    after_user_id: int = 0) -> AsyncIterator[int]:
+        """Потоковый обход подписанных пользователей (с user_id > after_user_id) порциями"""
+        last_user_id = after_user_id
+        while True:
+            # Соединение берём только на время выборки порции, а не на всю рассылку
+            async with self.connection() as db:
+                async with db.execute("""
+                    SELECT user_id FROM users
+                    WHERE is_subscribed = 1 AND user_id > ?
+                    ORDER BY user_id LIMIT ?
+                """, (last_user_id, chunk_size)) as cursor:
+                    rows = await cursor.fetchall()
+            
+            for row in rows:
+                yield row[0]
             
-            # Сравниваем ответы
-            matches = 0
-            total = 4  # Всего 4 вопроса
+            if len(rows) < chunk_size:
+                return
+            last_user_id = rows[-1][0]
+
+    async def unsubscribe_users(self, user_ids: List[int]):
+        """Отписка пользователей, до которых не доходят сообщения (одной транзакцией)"""
+        async with self.connection() as db:
+            # Делим на части, чтобы не превысить лимит параметров SQLite
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                await db.execute(f"""
+                    UPDATE users SET is_subscribed = 0
+                    WHERE user_id IN ({placeholders})
+                """, chunk)
+            await db.commit()
+
+    async def iter_slot_users(self, slot: int, chunk_size: int = config.BROADCAST_CHUNK_SIZE,
+                              after_user_id: int = 0) -> AsyncIterator[int]:
+        """Потоковый обход подписанных пользователей одного слота рассылки"""
+        last_user_id = after_user_id
+        while True:
+            async with self.connection() as db:
+                async with db.execute(f"""
+                    SELECT user_id FROM users
+                    WHERE is_subscribed = 1 AND user_id % {BROADCAST_SLOTS} = ?
+                        AND user_id > ?
+                    ORDER BY user_id LIMIT ?
+                """, (slot, last_user_id, chunk_size)) as cursor:
+                    rows = await cursor.fetchall()
             
-            if answer.get('name', '').lower() == test.get('name', '').lower():
-                matches += 1
-            if answer.get('height_range') == test.get('height_range'):
-                matches += 1
-            if answer.get('eye_color') == test.get('eye_color'):
-                matches += 1
-            if answer.get('fear') == test.get('fear'):
-                matches += 1
+            for row in rows:
+                yield row[0]
             
-            percentage = int((matches / total) * 100)
-            return percentage
+            if len(rows) < chunk_size:
+                return
+            last_user_id = rows[-1][0]
     
-    async def get_all_subscribed_users(self) -> List[int]:
-        """Получение списка всех подписанных пользователей"""
-        async with aiosqlite.connect(self.db_path) as db:
+    async def create_broadcast_job(self, message: str, mode: str = 'burst') -> int:
+        """Создание задания рассылки, возвращает его ID"""
+        async with self.connection() as db:
+            cursor = await db.execute("""
+                INSERT INTO broadcast_jobs (message, mode) VALUES (?, ?)
+            """, (message, mode))
+            await db.commit()
+            return cursor.lastrowid
+    
+    async def get_unfinished_broadcast_job(self) -> Optional[Dict]:
+        """Получение незавершённого задания рассылки (например, прерванного перезапуском)"""
+        async with self.connection() as db:
             async with db.execute("""
-                SELECT user_id FROM users WHERE is_subscribed = 1
+                SELECT * FROM broadcast_jobs
+                WHERE status = 'running'
+                ORDER BY job_id LIMIT 1
             """) as cursor:
-                rows = await cursor.fetchall()
-                return [row[0] for row in rows]
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+    
+    async def checkpoint_broadcast_job(self, job_id: int, cursor_user_id: int,
+                                       sent: int, failed: int, unreachable: int):
+        """Сохранение прогресса рассылки: все пользователи до cursor_user_id уже обработаны"""
+        async with self.connection() as db:
+            await db.execute("""
+                UPDATE broadcast_jobs
+                SET cursor_user_id = ?, sent = ?, failed = ?, unreachable = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = ?
+            """, (cursor_user_id, sent, failed, unreachable, job_id))
+            await db.commit()
+    
+    async def finish_broadcast_job(self, job_id: int):
+        """Отметка задания рассылки как завершённого"""
+        async with self.connection() as db:
+            await db.execute("""
+                UPDATE broadcast_jobs
+                SET status = 'done', updated_at = CURRENT_TIMESTAMP,
+                    finished_at = CURRENT_TIMESTAMP
+                WHERE job_id = ?
+            """, (job_id,))
+            await db.commit()
+    
+    async def get_broadcast_job(self, job_id: int) -> Optional[Dict]:
+        """Прогресс задания рассылки: счётчики, курсор, длительность и скорость"""
+        async with self.connection() as db:
+            async with db.execute("""
+                SELECT *,
+                    (julianday(COALESCE(finished_at, updated_at)) - julianday(started_at))
+                        * 86400 AS elapsed_seconds
+                FROM broadcast_jobs WHERE job_id = ?
+            """, (job_id,)) as cursor:
+                row = await cursor.fetchone()
+                if not row:
+                    return None
+                job = dict(row)
+                elapsed = job['elapsed_seconds'] or 0
+                job['rate'] = job['sent'] / elapsed if elapsed > 0 else 0.0
+                return job
+
+    async def get_last_broadcast_age(self) -> Optional[float]:
+        """Сколько секунд назад началась последняя рассылка (None - рассылок ещё не было)"""
+        async with self.connection() as db:
+            async with db.execute("""
+                SELECT (julianday('now') - julianday(started_at)) * 86400 FROM broadcast_jobs
+                WHERE job_id = (SELECT MAX(job_id) FROM broadcast_jobs)
+            """) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else None
+
+    async def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """
+        Захват или продление аренды name на ttl секунд.
+        Удаётся, если аренда свободна, истекла или уже принадлежит holder.
+        """
+        now = time.time()
+        async with self.connection() as db:
+            cursor = await db.execute("""
+                INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    holder = excluded.holder,
+                    expires_at = excluded.expires_at
+                WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+            """, (name, holder, now + ttl, now))
+            await db.commit()
+            return cursor.rowcount > 0
+    
+    async def release_lease(self, name: str, holder: str):
+        """Освобождение аренды, если она принадлежит holder"""
+        async with self.connection() as db:
+            await db.execute("""
+                DELETE FROM leases WHERE name = ? AND holder = ?
+            """, (name, holder))
+            await db.commit()
+
+    async def get_fsm_record(self, storage_key: str) -> Optional[Dict]:
+        """Получение состояния FSM и его данных (data - JSON-строка)"""
+        async with self.connection() as db:
+            async with db.execute("""
+                SELECT state, data, updated_at FROM fsm_states WHERE storage_key = ?
+            """, (storage_key,)) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+    
+    async def save_fsm_record(self, storage_key: str, state: Optional[str], data: str,
+                              updated_at: float):
+        """
+        Сохранение состояния FSM вместе с данными одной записью. Даже через очередь
+        отложенной записи возвращается после коммита: следующее сообщение читает состояние из базы
+        """
+        await self._execute_write([("""
+            INSERT INTO fsm_states (storage_key, state, data, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (storage_key) DO UPDATE SET
+                state = excluded.state,
+                data = excluded.data,
+                updated_at = excluded.updated_at
+        """, (storage_key, state, data, updated_at))], wait=True)
+    
+    async def delete_fsm_record(self, storage_key: str):
+        """Удаление состояния FSM (диалог завершён), тоже с ожиданием коммита"""
+        await self._execute_write([("""
+            DELETE FROM fsm_states WHERE storage_key = ?
+        """, (storage_key,))], wait=True)
+    
+    async def purge_fsm_records(self, updated_before: float) -> int:
+        """Удаление состояний FSM, не менявшихся с updated_before, возвращает их число"""
+        async with self.connection() as db:
+            cursor = await db.execute("""
+                DELETE FROM fsm_states WHERE updated_at < ?
+            """, (updated_before,))
+            await db.commit()
+            return cursor.rowcount
 
+    async def get_test_stats(self, test_id: str) -> Optional[Dict]:
+        """Агрегаты прохождений теста: число прохождений, средний и лучший результат, гистограмма"""
+        async with self.connection() as db:
+            async with db.execute("""
+                SELECT * FROM test_stats WHERE test_id = ?
+            """, (test_id,)) as cursor:
+                row = await cursor.fetchone()
+                if not row:
+                    return None
+        
+        stats = dict(row)
+        stats['mean_score'] = stats['score_sum'] / stats['completions'] if stats['completions'] else 0
+        stats['histogram'] = [stats[f'matches_{matches}'] for matches in range(TOTAL_QUESTIONS + 1)]
+        return stats
+    
+    async def rebuild_test_stats(self, chunk_size: int = 500) -> int:
+        """
+        Пересчёт агрегатов по сырым ответам. Тесты обходятся порциями по test_id,
+        ответы порции читаются потоком и заново оцениваются score_batch,
+        каждая порция записывается своей транзакцией. Возвращает число тестов
+        """
+        last_test_id = ''
+        rebuilt = 0
+        while True:
+            async with self.connection() as db:
+                # Блокировка на запись: ответы, сохранённые во время пересчёта порции,
+                # не потеряются и не посчитаются дважды
+                await db.execute("BEGIN IMMEDIATE")
+                try:
+                    async with db.execute("""
+                        SELECT test_id, name, answers_packed FROM tests
+                        WHERE test_id > ? ORDER BY test_id LIMIT ?
+                    """, (last_test_id, chunk_size)) as cursor:
+                        tests = {row['test_id']: dict(row) for row in await cursor.fetchall()}
+                    if not tests:
+                        await db.rollback()
+                        return rebuilt
+                    
+                    aggregates = {}
+                    placeholders = ", ".join("?" * len(tests))
+                    async with db.execute(f"""
+                        SELECT test_id, name, answers_packed FROM test_answers
+                        WHERE test_id IN ({placeholders}) ORDER BY test_id
+                    """, list(tests)) as cursor:
+                        while True:
+                            rows = await cursor.fetchmany(chunk_size)
+                            if not rows:
+                                break
+                            for test_id, answers in groupby(rows, key=lambda row: row['test_id']):
+                                answers = list(answers)
+                                scores = score_batch(
+                                    tests[test_id],
+                                    [answer['answers_packed'] for answer in answers],
+                                    [answer['name'] for answer in answers],
+                                )
+                                stats = aggregates.setdefault(test_id, [0, 0, 0] + [0] * (TOTAL_QUESTIONS + 1))
+                                for score in scores:
+                                    stats[0] += 1
+                                    stats[1] += score.percentage
+                                    stats[2] = max(stats[2], score.percentage)
+                                    stats[3 + score.matches] += 1
+                    
+                    await db.execute(f"""
+                        DELETE FROM test_stats WHERE test_id IN ({placeholders})
+                    """, list(tests))
+                    await db.executemany("""
+                        INSERT INTO test_stats (test_id, completions, score_sum, best_score,
+                                                matches_0, matches_1, matches_2, matches_3, matches_4)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, [(test_id, *stats) for test_id, stats in aggregates.items()])
+                    await db.commit()
+                except Exception:
+                    await db.rollback()
+                    raise
+            
+            rebuilt += len(tests)
+            last_test_id = next(reversed(tests))
@@ -0,0 +1,58 @@
+"""
+Сессия бота без сети - для локальных прогонов (вебхук, нагрузочные тесты, воспроизведение).
+Вызовы API не уходят в Telegram, а записываются и получают правдоподобный ответ
+"""
+import asyncio
+import datetime
+import itertools
+from typing import Any, AsyncGenerator, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetMe, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import Chat, Message, User
+
+FAKE_BOT_TOKEN = "42:fake-token"
+FAKE_BOT_USERNAME = "friends_test_local_bot"
+
+
+class RecordingSession(BaseSession):
+    """Сессия, которая записывает вызовы API; latency - имитация задержки Telegram в секундах"""
+
+    def __init__(self, latency: float = 0.0, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.calls: List[TelegramMethod] = []
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[TelegramType],
+                           timeout: Optional[int] = None) -> TelegramType:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.calls.append(method)
+
+        if isinstance(method, GetMe):
+            return User(id=bot.id, is_bot=True, first_name="Bot", username=FAKE_BOT_USERNAME)
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is not None and type(method).__name__.startswith(('Send', 'Edit')):
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.datetime.now(),
+                chat=Chat(id=chat_id, type='private'),
+                text=getattr(method, 'text', None),
+            )
+        return True
+
+    async def stream_content(self, url: str, headers: Optional[dict] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True
+                             ) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def make_fake_bot(latency: float = 0.0) -> Bot:
+    """Бот с RecordingSession"""
+    return Bot(token=FAKE_BOT_TOKEN, session=RecordingSession(latency), parse_mode="HTML")
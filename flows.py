@@ -0,0 +1,157 @@
+"""
+Анкета теста: вопросы и общий движок для создания и прохождения теста
+"""
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, List, NamedTuple, Optional, Type
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import CallableMixin
+from aiogram.filters import StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import Message, ReplyKeyboardMarkup
+
+from keyboards import (
+    EYE_COLOR_KEYBOARD, EYE_COLOR_OPTIONS, FEAR_KEYBOARD, FEAR_OPTIONS,
+    HEIGHT_KEYBOARD, HEIGHT_OPTIONS
+)
+from storage import SQLiteStorage
+
+
+class Question(NamedTuple):
+    """Вопрос анкеты"""
+    field: str                          # ключ ответа в данных FSM и в базе
+    emoji: str
+    prompts: Dict[str, str]             # текст вопроса для каждой анкеты ('create' / 'take')
+    invalid_text: str                   # ответ на некорректный ввод
+    options: Optional[FrozenSet[str]] = None    # None - свободный ввод
+    keyboard: Optional[ReplyKeyboardMarkup] = None
+
+    def parse(self, text: Optional[str]) -> Optional[str]:
+        """Проверка ответа, None если он некорректен"""
+        if text is None:
+            return None
+        if self.options is not None:
+            return text if text in self.options else None
+        text = text.strip()
+        return text if 0 < len(text) <= 100 else None
+
+
+QUESTIONS = (
+    Question(
+        field='name',
+        emoji="📝",
+        prompts={
+            'create': "Как тебя зовут? (введи своё имя)",
+            'take': "Как зовут твоего друга? (введи имя)",
+        },
+        invalid_text="Пожалуйста, введи корректное имя (до 100 символов).",
+    ),
+    Question(
+        field='height_range',
+        emoji="📏",
+        prompts={
+            'create': "Какой у тебя рост?",
+            'take': "Какой рост у твоего друга?",
+        },
+        invalid_text="Пожалуйста, выбери один из предложенных вариантов роста.",
+        options=frozenset(HEIGHT_OPTIONS),
+        keyboard=HEIGHT_KEYBOARD,
+    ),
+    Question(
+        field='eye_color',
+        emoji="👁️",
+        prompts={
+            'create': "Какого цвета у тебя глаза?",
+            'take': "Какого цвета глаза у твоего друга?",
+        },
+        invalid_text="Пожалуйста, выбери один из предложенных вариантов цвета глаз.",
+        options=frozenset(EYE_COLOR_OPTIONS),
+        keyboard=EYE_COLOR_KEYBOARD,
+    ),
+    Question(
+        field='fear',
+        emoji="😰",
+        prompts={
+            'create': "Чего ты боишься больше всего?",
+            'take': "Чего больше всего боится твой друг?",
+        },
+        invalid_text="Пожалуйста, выбери один из предложенных вариантов.",
+        options=frozenset(FEAR_OPTIONS),
+        keyboard=FEAR_KEYBOARD,
+    ),
+)
+
+
+async def set_state_and_data(state: FSMContext, new_state: Optional[State], data: Dict[str, Any]):
+    """Смена состояния и данных FSM - одной записью, если хранилище это умеет"""
+    if isinstance(state.storage, SQLiteStorage):
+        await state.storage.set_state_and_data(state.key, new_state, data)
+    else:
+        await state.set_data(data)
+        await state.set_state(new_state)
+
+
+async def clear_state(state: FSMContext):
+    """Завершение диалога одной записью (FSMContext.clear() меняет состояние и данные по очереди)"""
+    await set_state_and_data(state, None, {})
+
+
+class Questionnaire:
+    """
+    Анкета по QUESTIONS: шаг определяется по текущему состоянию FSM поиском в словаре,
+    все шаги обрабатывает одна функция. По последнему ответу вызывается
+    on_complete(message, state, data) с собранными ответами; как и обработчику,
+    ему передаются нужные именованные аргументы из данных диспетчера.
+    """
+
+    def __init__(self, router: Router, name: str, states: Type[StatesGroup],
+                 on_complete: Callable[..., Awaitable[None]]):
+        self.name = name
+        self.on_complete = CallableMixin(on_complete)
+        self.states: List[State] = list(states.__all_states__)
+        assert len(self.states) == len(QUESTIONS), "Каждому вопросу нужно своё состояние"
+        self.steps: Dict[str, int] = {state.state: index for index, state in enumerate(self.states)}
+        router.message(StateFilter(states))(self.handle)
+
+    def prompt(self, index: int) -> str:
+        """Текст вопроса с номером"""
+        question = QUESTIONS[index]
+        return (
+            f"{question.emoji} <b>Вопрос {index + 1} из {len(QUESTIONS)}:</b>\n"
+            f"{question.prompts[self.name]}"
+        )
+
+    async def start(self, message: Message, state: FSMContext, intro: str = "",
+                    data: Optional[Dict[str, Any]] = None, reply_markup=None):
+        """Начало анкеты с первого вопроса"""
+        await set_state_and_data(state, self.states[0], data or {})
+        await message.answer(
+            intro + self.prompt(0),
+            parse_mode="HTML",
+            reply_markup=reply_markup
+        )
+
+    async def handle(self, message: Message, state: FSMContext, raw_state: Optional[str],
+                     **kwargs: Any):
+        """Обработка ответа на текущий вопрос"""
+        index = self.steps[raw_state]
+        question = QUESTIONS[index]
+        value = question.parse(message.text)
+        if value is None:
+            await message.answer(question.invalid_text)
+            return
+
+        data = await state.get_data()
+        data[question.field] = value
+
+        if index + 1 == len(QUESTIONS):
+            await self.on_complete.call(message, state, data, **kwargs)
+            return
+
+        await set_state_and_data(state, self.states[index + 1], data)
+        next_question = QUESTIONS[index + 1]
+        await message.answer(
+            self.prompt(index + 1),
+            parse_mode="HTML",
+            reply_markup=next_question.keyboard
+        )
@@ -1,24 +1,29 @@
 """
 Обработчики общих команд и главного меню
 """
+from html import escape
+from typing import Dict, List
 from aiogram import Router, F
 from aiogram.filters import Command
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, Message
 from aiogram.fsm.context import FSMContext
-from keyboards import get_main_menu_keyboard
+from flows import clear_state
+from keyboards import (
+    MyTestsPageCallback, TestLeaderboardCallback, TestStatsCallback,
+    get_main_menu_keyboard, get_my_tests_keyboard
+)
 from database import Database
 
 router = Router()
-db = Database()
 
 
 @router.message(Command("start"))
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(message: Message, state: FSMContext, db: Database):
     """Обработчик команды /start"""
     import logging
     logger = logging.getLogger(__name__)
     
-    await state.clear()
+    await clear_state(state)
     
     user_id = message.from_user.id
     username = message.from_user.username
@@ -37,7 +42,7 @@ async def cmd_start(message: Message, state: FSMContext):
             # Запускаем прохождение теста
             from handlers.test_taking import start_test_taking
             try:
-                await start_test_taking(message, state, test_id)
+                await start_test_taking(message, state, test_id, db)
                 return
             except Exception as e:
                 logger.error(f"Error starting test: {e}", exc_info=True)
@@ -72,11 +77,21 @@ async def cmd_info(message: Message):
     await message.answer(info_text, parse_mode="HTML")
 
 
+def render_my_tests_page(bot_username: str, tests: List[Dict]) -> str:
+    """Текст страницы "Мой тест" со ссылками на тесты"""
+    text = "📋 <b>Твои тесты:</b>\n\n"
+    for test in tests:
+        test_link = f"https://t.me/{bot_username}?start={test['test_id']}"
+        text += f"• <b>{escape(test['name'])}</b>\n"
+        text += f"  Ссылка: {test_link}\n\n"
+    return text
+
+
 @router.message(F.text == "Мой тест")
-async def cmd_my_tests(message: Message):
-    """Показывает список тестов пользователя"""
+async def cmd_my_tests(message: Message, bot_username: str, db: Database):
+    """Показывает первую (самую новую) страницу тестов пользователя"""
     user_id = message.from_user.id
-    tests = await db.get_user_tests(user_id)
+    tests, has_next = await db.get_user_tests_page(user_id)
     
     if not tests:
         await message.answer(
@@ -85,15 +100,89 @@ async def cmd_my_tests(message: Message):
         )
         return
     
-    # Получаем username бота
-    bot_info = await message.bot.get_me()
-    bot_username = bot_info.username
+    await message.answer(
+        render_my_tests_page(bot_username, tests),
+        parse_mode="HTML",
+        reply_markup=get_my_tests_keyboard(tests, has_next=has_next)
+    )
+
+
+@router.callback_query(MyTestsPageCallback.filter())
+async def my_tests_page_callback(callback: CallbackQuery, callback_data: MyTestsPageCallback,
+                                 bot_username: str, db: Database):
+    """Переход на соседнюю страницу "Мой тест" - сообщение редактируется на месте"""
+    if callback_data.direction == 'prev':
+        tests, has_prev = await db.get_user_tests_page(
+            callback.from_user.id, before_test_id=callback_data.test_id
+        )
+        has_next = True
+    else:
+        tests, has_next = await db.get_user_tests_page(
+            callback.from_user.id, after_test_id=callback_data.test_id
+        )
+        has_prev = True
     
-    text = "📋 <b>Твои тесты:</b>\n\n"
-    for test in tests:
-        test_link = f"https://t.me/{bot_username}?start={test['test_id']}"
-        text += f"• <b>{test['name']}</b>\n"
-        text += f"  Ссылка: {test_link}\n\n"
+    if not tests:
+        await callback.answer("Больше тестов нет.")
+        return
+    
+    await callback.message.edit_text(
+        render_my_tests_page(bot_username, tests),
+        parse_mode="HTML",
+        reply_markup=get_my_tests_keyboard(tests, has_prev=has_prev, has_next=has_next)
+    )
+    await callback.answer()
+
+
+@router.callback_query(TestStatsCallback.filter())
+async def show_test_stats(callback: CallbackQuery, callback_data: TestStatsCallback,
+                          db: Database):
+    """Статистика прохождений теста для его автора"""
+    test = await db.get_test(callback_data.test_id)
+    if not test or test['creator_id'] != callback.from_user.id:
+        await callback.answer("Тест не найден.", show_alert=True)
+        return
+    
+    stats = await db.get_test_stats(callback_data.test_id)
+    if not stats:
+        await callback.message.answer(
+            f"📊 <b>{escape(test['name'])}</b>\n\nТвой тест пока никто не прошёл.",
+            parse_mode="HTML"
+        )
+        await callback.answer()
+        return
+    
+    text = (
+        f"📊 <b>{escape(test['name'])}</b>\n\n"
+        f"Прохождений: {stats['completions']}\n"
+        f"Средний результат: {stats['mean_score']:.0f}%\n"
+        f"Лучший результат: {stats['best_score']}%\n\n"
+        f"<b>Угадано ответов:</b>\n"
+    )
+    total = len(stats['histogram']) - 1
+    for matches, count in reversed(list(enumerate(stats['histogram']))):
+        text += f"{matches} из {total}: {count}\n"
     
-    await message.answer(text, parse_mode="HTML")
+    await callback.message.answer(text, parse_mode="HTML")
+    await callback.answer()
 
+
+@router.callback_query(TestLeaderboardCallback.filter())
+async def show_test_leaderboard(callback: CallbackQuery, callback_data: TestLeaderboardCallback,
+                                db: Database):
+    """Рейтинг друзей, которые лучше всех знают автора теста"""
+    test = await db.get_test(callback_data.test_id)
+    if not test or test['creator_id'] != callback.from_user.id:
+        await callback.answer("Тест не найден.", show_alert=True)
+        return
+    
+    leaders = await db.get_test_leaderboard(callback_data.test_id)
+    text = f"🏆 <b>{escape(test['name'])}: кто знает тебя лучше всех</b>\n\n"
+    if not leaders:
+        text += "Твой тест пока никто не прошёл."
+    for place, leader in enumerate(leaders, start=1):
+        friend = leader['first_name'] or (leader['username'] and f"@{leader['username']}") or "Друг"
+        text += f"{place}. {escape(friend)} — {leader['percentage']}%\n"
+    
+    await callback.message.answer(text, parse_mode="HTML")
+    await callback.answer()
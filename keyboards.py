@@ -1,71 +1,102 @@
 """
 Клавиатуры для бота
 """
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from typing import Dict, Sequence
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import (
+    ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+)
 
+# Варианты ответов на вопросы теста (порядок - как на клавиатуре)
+HEIGHT_OPTIONS = ("140-159", "160-179", "180-199", "200+")
+EYE_COLOR_OPTIONS = ("Карие", "Голубые", "Зелёные", "Серые")
+FEAR_OPTIONS = ("Высоты", "Темноты", "Пауков", "Одиночества")
 
-def get_main_menu_keyboard() -> ReplyKeyboardMarkup:
-    """Главное меню бота"""
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="Создать тест")],
-            [KeyboardButton(text="Пройти тест")],
-            [KeyboardButton(text="Мой тест")],
-            [KeyboardButton(text="Информация")]
-        ],
-        resize_keyboard=True
-    )
-    return keyboard
-
-
-def get_height_keyboard() -> ReplyKeyboardMarkup:
-    """Клавиатура для выбора роста"""
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="140-159")],
-            [KeyboardButton(text="160-179")],
-            [KeyboardButton(text="180-199")],
-            [KeyboardButton(text="200+")]
-        ],
-        resize_keyboard=True
-    )
-    return keyboard
-
-
-def get_eye_color_keyboard() -> ReplyKeyboardMarkup:
-    """Клавиатура для выбора цвета глаз"""
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="Карие")],
-            [KeyboardButton(text="Голубые")],
-            [KeyboardButton(text="Зелёные")],
-            [KeyboardButton(text="Серые")]
-        ],
-        resize_keyboard=True
-    )
-    return keyboard
-
-
-def get_fear_keyboard() -> ReplyKeyboardMarkup:
-    """Клавиатура для выбора страха"""
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="Высоты")],
-            [KeyboardButton(text="Темноты")],
-            [KeyboardButton(text="Пауков")],
-            [KeyboardButton(text="Одиночества")]
-        ],
+
+def _options_keyboard(options: Sequence[str]) -> ReplyKeyboardMarkup:
+    """Клавиатура с вариантами ответа, по одному в строке"""
+    return ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=option)] for option in options],
         resize_keyboard=True
     )
-    return keyboard
+
+
+# Статичные клавиатуры собираются один раз при импорте и переиспользуются всеми
+# обработчиками. Экземпляры общие - изменять их нельзя, только передавать в reply_markup
+MAIN_MENU_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="Создать тест")],
+        [KeyboardButton(text="Пройти тест")],
+        [KeyboardButton(text="Мой тест")],
+        [KeyboardButton(text="Информация")]
+    ],
+    resize_keyboard=True
+)
+HEIGHT_KEYBOARD = _options_keyboard(HEIGHT_OPTIONS)
+EYE_COLOR_KEYBOARD = _options_keyboard(EYE_COLOR_OPTIONS)
+FEAR_KEYBOARD = _options_keyboard(FEAR_OPTIONS)
+REMOVE_KEYBOARD = ReplyKeyboardRemove()
+CREATE_TEST_BUTTON = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="Создать свой тест дружбы", callback_data="create_test_after")]
+    ]
+)
+
+
+def get_main_menu_keyboard() -> ReplyKeyboardMarkup:
+    """Главное меню бота"""
+    return MAIN_MENU_KEYBOARD
 
 
 def get_create_test_button() -> InlineKeyboardMarkup:
     """Кнопка для создания своего теста после прохождения"""
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Создать свой тест дружбы", callback_data="create_test_after")]
-        ]
-    )
-    return keyboard
+    return CREATE_TEST_BUTTON
+
+
+class TestStatsCallback(CallbackData, prefix="stats"):
+    """Кнопка статистики теста"""
+    test_id: str
 
+
+class TestLeaderboardCallback(CallbackData, prefix="top"):
+    """Кнопка рейтинга друзей теста"""
+    test_id: str
+
+
+class MyTestsPageCallback(CallbackData, prefix="mytests"):
+    """Переход по страницам "Мой тест": direction - 'next' (старше) или 'prev' (новее),
+    test_id - последний или первый тест текущей страницы"""
+    direction: str
+    test_id: str
+
+
+def get_my_tests_keyboard(tests: Sequence[Dict], has_prev: bool = False,
+                          has_next: bool = False) -> InlineKeyboardMarkup:
+    """Кнопки статистики и рейтинга для страницы тестов автора и навигация по страницам"""
+    rows = [
+        [
+            InlineKeyboardButton(
+                text=f"📊 {test['name']}",
+                callback_data=TestStatsCallback(test_id=test['test_id']).pack()
+            ),
+            InlineKeyboardButton(
+                text="🏆 Топ друзей",
+                callback_data=TestLeaderboardCallback(test_id=test['test_id']).pack()
+            ),
+        ]
+        for test in tests
+    ]
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(
+            text="⬅️ Новее",
+            callback_data=MyTestsPageCallback(direction='prev', test_id=tests[0]['test_id']).pack()
+        ))
+    if has_next:
+        navigation.append(InlineKeyboardButton(
+            text="Старше ➡️",
+            callback_data=MyTestsPageCallback(direction='next', test_id=tests[-1]['test_id']).pack()
+        ))
+    if navigation:
+        rows.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
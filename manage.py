@@ -0,0 +1,43 @@
+"""
+Служебные команды обслуживания базы данных
+
+    python manage.py rebuild-stats    # пересчёт агрегатов тестов по сырым ответам
+"""
+import argparse
+import asyncio
+import logging
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+async def rebuild_stats(chunk_size: int):
+    """Пересчёт таблицы test_stats"""
+    db = Database()
+    await db.init_db()
+    try:
+        rebuilt = await db.rebuild_test_stats(chunk_size)
+        logger.info(f"Test stats rebuilt for {rebuilt} tests")
+    finally:
+        await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    rebuild = commands.add_parser('rebuild-stats', help="Пересчитать статистику тестов")
+    rebuild.add_argument('--chunk-size', type=int, default=500,
+                         help="Сколько тестов пересчитывать одной транзакцией")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if args.command == 'rebuild-stats':
+        asyncio.run(rebuild_stats(args.chunk_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""
+Метрики в формате Prometheus: задержки обработчиков, состояний FSM и запросов к базе,
+счётчики вызовов Telegram API и статистика пулов, кэшей и очередей.
+Без внешних зависимостей; запись метрики - несколько арифметических операций,
+поэтому метрики можно держать включёнными в продакшене.
+"""
+import functools
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from typing import (
+    Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+)
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержки, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+class Counter:
+    """Счётчик с метками"""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in self.values.items():
+            labels = dict(zip(self.label_names, label_values))
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма с метками: счётчики по корзинам, сумма и число наблюдений"""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики корзин (последняя - +Inf), сумма, число]
+        self.values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, (bucket_counts, total, count) in self.values.items():
+            labels = dict(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': le})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    """Метрики процесса и сборщики готовой статистики (пулы, кэши, очереди)"""
+
+    def __init__(self):
+        self.metrics: List[Any] = []
+        self.collectors: Dict[str, Callable[[], Iterable[Sample]]] = {}
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, label_names)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, label_names, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, name: str, collect: Callable[[], Iterable[Sample]]):
+        """Сборщик вызывается при каждом запросе метрик; повторная регистрация заменяет прежний"""
+        self.collectors[name] = collect
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        # Строки одной метрики должны идти подряд, а её выдают несколько сборщиков
+        # (например, по шардам) вперемешку с другими - группируем по имени
+        families: Dict[str, List[str]] = {}
+        for name, collect in self.collectors.items():
+            try:
+                samples = list(collect())
+            except Exception as e:
+                logger.error(f"Metrics collector {name} failed: {e}")
+                continue
+            for sample_name, labels, value in samples:
+                families.setdefault(sample_name, []).append(
+                    f"{sample_name}{_format_labels(labels)} {float(value)}"
+                )
+        for sample_name, family in families.items():
+            lines.append(f"# TYPE {sample_name} gauge")
+            lines.extend(family)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_DURATION = REGISTRY.histogram(
+    "bot_handler_duration_seconds", "Время работы обработчика обновления", ["handler"]
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ["handler", "error"]
+)
+STATE_DURATION = REGISTRY.histogram(
+    "bot_fsm_state_duration_seconds", "Время обработки обновления по состоянию FSM", ["state"]
+)
+DATABASE_DURATION = REGISTRY.histogram(
+    "bot_database_duration_seconds", "Время выполнения методов Database", ["method"]
+)
+API_DURATION = REGISTRY.histogram(
+    "bot_api_request_duration_seconds", "Время вызова Telegram Bot API", ["method"]
+)
+API_REQUESTS = REGISTRY.counter(
+    "bot_api_requests_total", "Вызовы Telegram Bot API", ["method"]
+)
+API_ERRORS = REGISTRY.counter(
+    "bot_api_errors_total", "Ошибки вызовов Telegram Bot API", ["method", "error"]
+)
+
+
+def stats_samples(prefix: str, stats: Dict[str, Any], label_name: Optional[str] = None,
+                  labels: Optional[Dict[str, str]] = None) -> List[Sample]:
+    """
+    Перевод словаря stats() в метрики: числовые значения - в prefix_<ключ>.
+    Вложенные словари разворачиваются в prefix_<ключ>_..., а если задан label_name -
+    в те же имена с меткой label_name=<ключ> (например, по классам приоритета)
+    """
+    labels = labels or {}
+    samples = []
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            if label_name is None:
+                samples.extend(stats_samples(f"{prefix}_{key}", value, labels=labels))
+            else:
+                samples.extend(stats_samples(prefix, value, labels={**labels, label_name: str(key)}))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            samples.append((f"{prefix}_{key}", labels, value))
+    return samples
+
+
+def _handler_name(data: Dict[str, Any]) -> str:
+    handler = data.get("handler")
+    callback = getattr(handler, "callback", None)
+    if callback is None:
+        return "unknown"
+    return f"{callback.__module__}.{callback.__qualname__}"
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренняя мидлварь: задержка и ошибки каждого обработчика и каждого состояния FSM"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        name = _handler_name(data)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLER_DURATION.observe(elapsed, name)
+            STATE_DURATION.observe(elapsed, data.get("raw_state") or "none")
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Мидлварь сессии бота: число, время и ошибки вызовов Telegram API"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = type(method).__name__
+        API_REQUESTS.inc(name)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            API_DURATION.observe(time.perf_counter() - started, name)
+
+
+def _timed(name: str, method: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            DATABASE_DURATION.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+def _timed_generator(name: str,
+                     method: Callable[..., AsyncIterator[Any]]) -> Callable[..., AsyncIterator[Any]]:
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            async for item in method(*args, **kwargs):
+                yield item
+        finally:
+            DATABASE_DURATION.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+def instrument_database(db):
+    """
+    Замер времени публичных методов экземпляра db: корутин - до результата,
+    потоковых выборок - от начала обхода до исчерпания. Класс Database и другие
+    экземпляры не меняются; повторный вызов ничего не меняет
+    """
+    for name, method in vars(type(db)).items():
+        if name.startswith("_") or name in vars(db):
+            continue
+        if inspect.iscoroutinefunction(method):
+            setattr(db, name, _timed(name, getattr(db, name)))
+        elif inspect.isasyncgenfunction(method):
+            setattr(db, name, _timed_generator(name, getattr(db, name)))
+
+
+def setup_metrics(bot: Bot, dp: Optional[Dispatcher] = None, db=None, outbound=None):
+    """
+    Подключение метрик к боту, диспетчеру и базе. Мидлварь сессии регистрируется
+    после OutboundMiddleware, поэтому время API не включает ожидание лимита отправки
+    """
+    bot.session.middleware(ApiMetricsMiddleware())
+    if dp is not None:
+        middleware = HandlerMetricsMiddleware()
+        # Внутренние мидлвари диспетчера действуют и на обработчики вложенных роутеров
+        dp.message.middleware(middleware)
+        dp.callback_query.middleware(middleware)
+
+    if db is not None:
+        instrument_database(db)
+
+        def collect_database() -> List[Sample]:
+            samples = stats_samples("bot_test_cache", db.test_cache.stats())
+            if db.pool is not None:
+                samples += stats_samples("bot_database_pool", db.pool.stats())
+            if db.write_queue is not None:
+                samples += stats_samples("bot_write_behind", db.write_queue.stats())
+            return samples
+        REGISTRY.add_collector("database", collect_database)
+
+    if dp is not None and hasattr(dp.fsm.storage, "cache"):
+        REGISTRY.add_collector(
+            "fsm_cache", lambda: stats_samples("bot_fsm_cache", dp.fsm.storage.cache.stats())
+        )
+
+    throttling = dp.workflow_data.get("throttling") if dp is not None else None
+    if throttling is not None:
+        REGISTRY.add_collector(
+            "throttling", lambda: stats_samples("bot_throttling", throttling.stats())
+        )
+
+    if outbound is not None:
+        REGISTRY.add_collector(
+            "outbound", lambda: stats_samples("bot_outbound", outbound.stats(), "priority")
+        )
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(port: int = config.METRICS_PORT,
+                               host: str = config.METRICS_HOST) -> web.AppRunner:
+    """HTTP-эндпоинт /metrics"""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics available at http://{host}:{port}/metrics")
+    return runner
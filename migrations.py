@@ -0,0 +1,282 @@
+"""
+Версионные миграции схемы базы данных
+"""
+import logging
+import aiosqlite
+from scoring import pack_answers, score_answer
+
+logger = logging.getLogger(__name__)
+
+# Число слотов равномерной рассылки: слот пользователя - user_id % BROADCAST_SLOTS.
+# Значение зашито в выражение индекса, поэтому менять его можно только новой миграцией
+BROADCAST_SLOTS = 4096
+
+
+async def _backfill_answer_scores(db: aiosqlite.Connection):
+    """Подсчёт результата для ответов, сохранённых до появления колонок результата"""
+    last_answer_id = 0
+    while True:
+        async with db.execute("""
+            SELECT a.answer_id, a.name, a.height_range, a.eye_color, a.fear,
+                t.name AS test_name, t.height_range AS test_height_range,
+                t.eye_color AS test_eye_color, t.fear AS test_fear
+            FROM test_answers a JOIN tests t ON t.test_id = a.test_id
+            WHERE a.answer_id > ?
+            ORDER BY a.answer_id LIMIT 1000
+        """, (last_answer_id,)) as cursor:
+            rows = await cursor.fetchall()
+        if not rows:
+            return
+        
+        updates = []
+        for row in rows:
+            test = {
+                'name': row['test_name'], 'height_range': row['test_height_range'],
+                'eye_color': row['test_eye_color'], 'fear': row['test_fear'],
+            }
+            score = score_answer(test, dict(row))
+            updates.append((score.matches, score.percentage, row['answer_id']))
+        await db.executemany("""
+            UPDATE test_answers SET matches = ?, percentage = ? WHERE answer_id = ?
+        """, updates)
+        last_answer_id = rows[-1]['answer_id']
+
+
+async def _pack_choice_answers(db: aiosqlite.Connection):
+    """Перенос ответов из текстовых колонок в answers_packed"""
+    for table, key in (('tests', 'rowid'), ('test_answers', 'answer_id')):
+        last_key = 0
+        while True:
+            async with db.execute(f"""
+                SELECT {key} AS row_key, height_range, eye_color, fear FROM {table}
+                WHERE {key} > ? ORDER BY {key} LIMIT 1000
+            """, (last_key,)) as cursor:
+                rows = await cursor.fetchall()
+            if not rows:
+                break
+            await db.executemany(f"""
+                UPDATE {table} SET answers_packed = ? WHERE {key} = ?
+            """, [(pack_answers(dict(row)), row['row_key']) for row in rows])
+            last_key = rows[-1]['row_key']
+
+
+# Упорядоченный список миграций: (версия, описание, шаги).
+# Шаг - SQL-выражение или корутина, принимающая соединение.
+# Уже применённые миграции менять нельзя - только добавлять новые.
+MIGRATIONS = [
+    (1, "Базовые таблицы", [
+        # Таблица пользователей
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_subscribed INTEGER DEFAULT 1
+        )
+        """,
+        # Таблица тестов
+        """
+        CREATE TABLE IF NOT EXISTS tests (
+            test_id TEXT PRIMARY KEY,
+            creator_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            height_range TEXT,
+            eye_color TEXT,
+            fear TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (creator_id) REFERENCES users(user_id)
+        )
+        """,
+        # Таблица ответов пользователей на тесты
+        """
+        CREATE TABLE IF NOT EXISTS test_answers (
+            answer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            test_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            name TEXT,
+            height_range TEXT,
+            eye_color TEXT,
+            fear TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (test_id) REFERENCES tests(test_id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        """,
+    ]),
+    (2, "Индексы для горячих запросов", [
+        # Список тестов автора: поиск по автору и сортировка по дате без временного B-дерева
+        # (для постраничного списка заменён индексом миграции 11)
+        """
+        CREATE INDEX IF NOT EXISTS idx_tests_creator_created
+        ON tests (creator_id, created_at)
+        """,
+        # Ответы на тест по пользователю в порядке времени
+        """
+        CREATE INDEX IF NOT EXISTS idx_test_answers_test_user_created
+        ON test_answers (test_id, user_id, created_at)
+        """,
+        # Рассылка: обход только подписанных пользователей
+        """
+        CREATE INDEX IF NOT EXISTS idx_users_subscribed
+        ON users (user_id) WHERE is_subscribed = 1
+        """,
+    ]),
+    (3, "Задания рассылки с контрольными точками", [
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            cursor_user_id INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            unreachable INTEGER NOT NULL DEFAULT 0,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status
+        ON broadcast_jobs (status)
+        """,
+    ]),
+    (4, "Аренда лидерства между репликами", [
+        """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """,
+    ]),
+    (5, "Равномерная рассылка по слотам", [
+        """
+        ALTER TABLE broadcast_jobs ADD COLUMN mode TEXT NOT NULL DEFAULT 'burst'
+        """,
+        # Обход подписчиков слота по возрастанию user_id
+        f"""
+        CREATE INDEX IF NOT EXISTS idx_users_broadcast_slot
+        ON users ((user_id % {BROADCAST_SLOTS}), user_id) WHERE is_subscribed = 1
+        """,
+    ]),
+    (6, "Результат прохождения хранится вместе с ответом", [
+        "ALTER TABLE test_answers ADD COLUMN matches INTEGER",
+        "ALTER TABLE test_answers ADD COLUMN percentage INTEGER",
+        _backfill_answer_scores,
+    ]),
+    (7, "Хранилище состояний FSM", [
+        """
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            storage_key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        )
+        """,
+        # Удаление брошенных диалогов по сроку давности
+        """
+        CREATE INDEX IF NOT EXISTS idx_fsm_states_updated
+        ON fsm_states (updated_at)
+        """,
+    ]),
+    (8, "Ответы с выбором варианта упакованы в одно число", [
+        "ALTER TABLE tests ADD COLUMN answers_packed INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE test_answers ADD COLUMN answers_packed INTEGER NOT NULL DEFAULT 0",
+        _pack_choice_answers,
+        "ALTER TABLE tests DROP COLUMN height_range",
+        "ALTER TABLE tests DROP COLUMN eye_color",
+        "ALTER TABLE tests DROP COLUMN fear",
+        "ALTER TABLE test_answers DROP COLUMN height_range",
+        "ALTER TABLE test_answers DROP COLUMN eye_color",
+        "ALTER TABLE test_answers DROP COLUMN fear",
+    ]),
+    (9, "Агрегаты прохождений по тестам", [
+        # matches_N - сколько раз друзья угадали ровно N ответов из 4
+        """
+        CREATE TABLE IF NOT EXISTS test_stats (
+            test_id TEXT PRIMARY KEY,
+            completions INTEGER NOT NULL DEFAULT 0,
+            score_sum INTEGER NOT NULL DEFAULT 0,
+            best_score INTEGER NOT NULL DEFAULT 0,
+            matches_0 INTEGER NOT NULL DEFAULT 0,
+            matches_1 INTEGER NOT NULL DEFAULT 0,
+            matches_2 INTEGER NOT NULL DEFAULT 0,
+            matches_3 INTEGER NOT NULL DEFAULT 0,
+            matches_4 INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (test_id) REFERENCES tests(test_id)
+        )
+        """,
+        """
+        INSERT OR REPLACE INTO test_stats
+        SELECT test_id, COUNT(*), SUM(percentage), MAX(percentage),
+            SUM(matches = 0), SUM(matches = 1), SUM(matches = 2),
+            SUM(matches = 3), SUM(matches = 4)
+        FROM test_answers GROUP BY test_id
+        """,
+    ]),
+    (10, "Индекс рейтинга друзей", [
+        # get_test_leaderboard: ответы теста по убыванию результата без сортировки
+        """
+        CREATE INDEX IF NOT EXISTS idx_test_answers_test_percentage
+        ON test_answers (test_id, percentage DESC, created_at, user_id)
+        """,
+    ]),
+    (11, "Постраничный список тестов автора", [
+        # get_user_tests_page: test_id делает ключ страницы уникальным при равных created_at
+        """
+        CREATE INDEX IF NOT EXISTS idx_tests_creator_created_test
+        ON tests (creator_id, created_at, test_id)
+        """,
+        "DROP INDEX IF EXISTS idx_tests_creator_created",
+    ]),
+]
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    """Текущая версия схемы (0 - миграции ещё не применялись)"""
+    async with db.execute("SELECT MAX(version) FROM schema_version") as cursor:
+        row = await cursor.fetchone()
+        return row[0] or 0
+
+
+async def apply_migrations(db: aiosqlite.Connection) -> int:
+    """Применение всех недостающих миграций по порядку, возвращает версию схемы"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.commit()
+
+    version = await get_schema_version(db)
+    for migration_version, description, steps in MIGRATIONS:
+        if migration_version <= version:
+            continue
+
+        # Каждая миграция - отдельная транзакция с блокировкой на запись,
+        # чтобы параллельно стартующие процессы не применили её дважды
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            if await get_schema_version(db) >= migration_version:
+                await db.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    await step(db)
+                else:
+                    await db.execute(step)
+            await db.execute("""
+                INSERT INTO schema_version (version, description) VALUES (?, ?)
+            """, (migration_version, description))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        logger.info(f"Applied migration {migration_version}: {description}")
+        version = migration_version
+
+    return version
@@ -0,0 +1,169 @@
+"""
+Общий слой исходящих сообщений: единый лимит скорости и приоритеты
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+import config
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Классы приоритета исходящих сообщений (меньше - важнее)"""
+    INTERACTIVE = 0
+    BULK = 1
+
+
+# Приоритет отправок в текущей задаче: ответы обработчиков по умолчанию интерактивные,
+# рассылка выставляет BULK в своих воркерах
+send_priority: ContextVar[Priority] = ContextVar('send_priority', default=Priority.INTERACTIVE)
+
+# Методы, на которые распространяются лимиты Telegram на отправку сообщений
+RATE_LIMITED_PREFIXES = ('Send', 'Forward', 'Copy', 'Edit')
+
+
+def is_rate_limited(method: TelegramMethod) -> bool:
+    """Учитывается ли вызов API в лимите отправки сообщений"""
+    return type(method).__name__.startswith(RATE_LIMITED_PREFIXES)
+
+
+class OutboundLimiter:
+    """
+    Единое ведро токенов для всех исходящих сообщений.
+    Ожидающие отправки обслуживаются по приоритету, а массовым отправкам
+    недоступны последние bulk_reserve токенов - они оставлены для ответов пользователям.
+    """
+
+    def __init__(self, rate: float = config.OUTBOUND_RATE_LIMIT,
+                 bulk_reserve: float = config.OUTBOUND_BULK_RESERVE):
+        self.bucket = TokenBucket(rate)
+        self.bulk_reserve = bulk_reserve
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        # Будит диспетчер, когда в очередь встаёт отправка (возможно, более важная)
+        self._wakeup = asyncio.Event()
+        # Метрики по классам приоритета
+        self.queued: Dict[Priority, int] = {p: 0 for p in Priority}
+        self.sent: Dict[Priority, int] = {p: 0 for p in Priority}
+        self.wait_time_total: Dict[Priority, float] = {p: 0.0 for p in Priority}
+        self.wait_time_max: Dict[Priority, float] = {p: 0.0 for p in Priority}
+
+    def _reserve(self, priority: Priority) -> float:
+        return self.bulk_reserve if priority >= Priority.BULK else 0.0
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE):
+        """Ожидание разрешения на отправку одного сообщения"""
+        started = time.monotonic()
+        # Без очереди отправляем сразу, если никто не ждёт с тем же или более высоким приоритетом
+        has_preceding = any(self.queued[p] for p in Priority if p <= priority)
+        if not has_preceding and self.bucket.try_consume(reserve=self._reserve(priority)):
+            self._record(priority, 0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self.queued[priority] += 1
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await future
+        finally:
+            self.queued[priority] -= 1
+        self._record(priority, time.monotonic() - started)
+
+    async def _dispatch(self):
+        """Выдача токенов ожидающим в порядке приоритета"""
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                # Отправка отменена, пока ждала в очереди
+                heapq.heappop(self._waiters)
+                continue
+            reserve = self._reserve(priority)
+            if self.bucket.try_consume(reserve=reserve):
+                heapq.heappop(self._waiters)
+                future.set_result(None)
+            else:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), timeout=self.bucket.delay(reserve=reserve)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+
+    def _record(self, priority: Priority, waited: float):
+        self.sent[priority] += 1
+        self.wait_time_total[priority] += waited
+        self.wait_time_max[priority] = max(self.wait_time_max[priority], waited)
+
+    def pause(self, seconds: float):
+        """Остановка всех отправок (флуд-контроль Telegram действует на весь бот)"""
+        logger.warning(f"Outbound flood control, pausing sends for {seconds}s")
+        self.bucket.pause(seconds)
+
+    def stats(self) -> Dict[str, Dict]:
+        """Глубина очереди и время ожидания по классам приоритета"""
+        return {
+            priority.name.lower(): {
+                'queued': self.queued[priority],
+                'sent': self.sent[priority],
+                'wait_time_avg_ms': (
+                    self.wait_time_total[priority] / self.sent[priority] * 1000
+                    if self.sent[priority] else 0.0
+                ),
+                'wait_time_max_ms': self.wait_time_max[priority] * 1000,
+            }
+            for priority in Priority
+        }
+
+
+class OutboundMiddleware(BaseRequestMiddleware):
+    """Мидлварь сессии бота: каждая отправка сообщения проходит через OutboundLimiter"""
+
+    def __init__(self, limiter: OutboundLimiter):
+        self.limiter = limiter
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not is_rate_limited(method):
+            return await make_request(bot, method)
+
+        await self.limiter.acquire(send_priority.get())
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            self.limiter.pause(e.retry_after)
+            raise
+
+
+def has_outbound_limiter(bot: Bot) -> bool:
+    """Подключён ли к сессии бота общий слой отправки"""
+    return any(isinstance(middleware, OutboundMiddleware) for middleware in bot.session.middleware)
+
+
+def setup_outbound(bot: Bot, limiter: Optional[OutboundLimiter] = None) -> OutboundLimiter:
+    """Подключение общего слоя отправки к сессии бота"""
+    limiter = limiter or OutboundLimiter()
+    bot.session.middleware(OutboundMiddleware(limiter))
+    return limiter
@@ -0,0 +1,58 @@
+"""
+Ограничение частоты событий (алгоритм "ведро токенов")
+"""
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Ведро токенов: в среднем не более rate событий в секунду, всплеск до burst"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        """Пополнение ведра за прошедшее время"""
+        start = max(self.updated, self.paused_until)
+        if now > start:
+            self.tokens = min(self.capacity, self.tokens + (now - start) * self.rate)
+        self.updated = now
+
+    def try_consume(self, tokens: float = 1.0, reserve: float = 0.0) -> bool:
+        """
+        Списание токенов без ожидания, False если их не хватает.
+        reserve - сколько токенов должно остаться в ведре после списания
+        """
+        now = time.monotonic()
+        self._refill(now)
+        if now >= self.paused_until and self.tokens >= tokens + reserve:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1.0, reserve: float = 0.0) -> float:
+        """Сколько секунд ждать, пока накопится нужное число токенов"""
+        now = time.monotonic()
+        self._refill(now)
+        pause = max(0.0, self.paused_until - now)
+        missing = max(0.0, tokens + reserve - self.tokens)
+        return pause + missing / self.rate
+
+    async def acquire(self, tokens: float = 1.0):
+        """Ожидание и списание токенов (ожидающие обслуживаются по очереди)"""
+        async with self._lock:
+            while not self.try_consume(tokens):
+                await asyncio.sleep(self.delay(tokens))
+
+    def pause(self, seconds: float):
+        """Полная остановка выдачи токенов (например, по RetryAfter от Telegram)"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, now + seconds)
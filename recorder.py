@@ -0,0 +1,156 @@
+"""
+Запись входящих обновлений для последующего воспроизведения (replay.py).
+Обновления обезличиваются: идентификаторы пользователей и чатов заменяются
+псевдонимами, имена удаляются, свободный текст и идентификаторы файлов
+заменяются токенами.
+Формат - JSONL, строка {"t": время получения, "u": обновление}, файл только дописывается.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import TelegramObject, Update
+
+import config
+from keyboards import EYE_COLOR_OPTIONS, FEAR_OPTIONS, HEIGHT_OPTIONS
+
+logger = logging.getLogger(__name__)
+
+# Тексты, которые сохраняются как есть: команды, кнопки меню и варианты ответов
+KNOWN_TEXTS = frozenset((
+    "/start", "Создать тест", "Пройти тест", "Мой тест", "Информация",
+    *HEIGHT_OPTIONS, *EYE_COLOR_OPTIONS, *FEAR_OPTIONS,
+))
+
+# Ссылка на тест: /start с идентификатором теста (он не персональный) - тоже как есть
+TEST_LINK_RE = re.compile(r"/start test_[0-9a-f]{12}")
+
+# Идентификаторы файлов: по ним с токеном бота можно скачать исходное фото или голосовое
+FILE_ID_FIELDS = ("file_id", "file_unique_id")
+
+# Персональные поля пользователей и чатов, которые не записываются
+PERSONAL_FIELDS = ("first_name", "last_name", "username", "title", "bio", "phone_number")
+
+# Сколько записей держать в буфере до записи в файл
+FLUSH_EVERY = 100
+
+
+class Anonymizer:
+    """Обезличивание обновления; один и тот же исходный id или текст даёт один и тот же псевдоним"""
+
+    def __init__(self, salt: str = config.RECORD_SALT):
+        self.key = (salt or os.urandom(16).hex()).encode()
+
+    def _digest(self, value: str) -> bytes:
+        return hmac.new(self.key, value.encode(), hashlib.sha256).digest()
+
+    def user_id(self, user_id: int) -> int:
+        # 40 бит хватает, чтобы псевдонимы не пересекались, и они похожи на настоящие id
+        pseudonym = int.from_bytes(self._digest(f"id:{user_id}")[:5], "big") or 1
+        return pseudonym if user_id > 0 else -pseudonym
+
+    def text(self, text: str) -> str:
+        """Команды, кнопки и ссылки на тесты - как есть, остальное (в том числе команды
+        с произвольными аргументами) - токеном без учёта регистра, как при сравнении имён в тесте"""
+        if text in KNOWN_TEXTS or TEST_LINK_RE.fullmatch(text):
+            return text
+        return "text_" + self._digest(f"text:{text.strip().lower()}")[:4].hex()
+
+    def file_id(self, file_id: str) -> str:
+        return "file_" + self._digest(f"file:{file_id}")[:8].hex()
+
+    def anonymize(self, value: Any) -> Any:
+        if isinstance(value, dict):
+            is_person = "id" in value and ("is_bot" in value or "type" in value)
+            result = {}
+            for field, item in value.items():
+                if is_person and field in PERSONAL_FIELDS:
+                    continue
+                if is_person and field == "id":
+                    result[field] = self.user_id(item)
+                elif field in ("text", "caption") and isinstance(item, str):
+                    result[field] = self.text(item)
+                elif field in FILE_ID_FIELDS and isinstance(item, str):
+                    result[field] = self.file_id(item)
+                elif field in ("contact", "location", "venue", "entities"):
+                    continue
+                else:
+                    result[field] = self.anonymize(item)
+            if is_person and "is_bot" in value:
+                result["first_name"] = "User"
+            return result
+        if isinstance(value, list):
+            return [self.anonymize(item) for item in value]
+        return value
+
+
+class UpdateRecorder(BaseMiddleware):
+    """Внешняя мидлварь обновлений: запись каждого обновления до обработки"""
+
+    def __init__(self, path: str, anonymizer: Optional[Anonymizer] = None):
+        self.path = path
+        self.anonymizer = anonymizer or Anonymizer()
+        self.recorded = 0
+        self._buffer = []
+        self._file = open(path, "a", encoding="utf-8")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            raw = event.model_dump(mode="json", exclude_none=True, by_alias=True)
+            record = {"t": round(time.time(), 3), "u": self.anonymizer.anonymize(raw)}
+            self._buffer.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+            self.recorded += 1
+            if len(self._buffer) >= FLUSH_EVERY:
+                self.flush()
+        except Exception as e:
+            # Запись - вспомогательная функция, обработку обновления она не ломает
+            logger.error(f"Error recording update: {e}")
+        return await handler(event, data)
+
+    def flush(self):
+        if self._buffer:
+            self._file.write("\n".join(self._buffer) + "\n")
+            self._file.flush()
+            self._buffer.clear()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        logger.info(f"Recorded {self.recorded} updates to {self.path}")
+
+
+def setup_recorder(dp: Dispatcher, path: str = config.RECORD_UPDATES_PATH) -> UpdateRecorder:
+    """Подключение записи обновлений к диспетчеру (файл дописывается и закрывается при остановке)"""
+    if not config.RECORD_SALT:
+        logger.warning("RECORD_SALT is not set: pseudonyms will differ between runs")
+    recorder = UpdateRecorder(path)
+    # Запись встаёт сразу после UserContextMiddleware - до ограничения частоты и FSM,
+    # чтобы в файл попадали и отброшенные обновления
+    manager = dp.update.outer_middleware
+    position = next(
+        index for index, middleware in enumerate(manager)
+        if isinstance(middleware, UserContextMiddleware)
+    ) + 1
+    following = list(manager[position:])
+    for middleware in following:
+        manager.unregister(middleware)
+    manager(recorder)
+    for middleware in following:
+        manager(middleware)
+
+    async def close_recorder():
+        recorder.close()
+    dp.shutdown.register(close_recorder)
+    return recorder
@@ -0,0 +1,156 @@
+"""
+Воспроизведение записанных обновлений (см. recorder.py) через настоящий Dispatcher
+с временной базой и сессией бота без сети (fakebot). Результат - пропускная способность
+и задержки в JSON, его можно сравнить с сохранённым базовым прогоном.
+
+    python replay.py updates.jsonl                      # как можно быстрее
+    python replay.py updates.jsonl --speed 1            # в исходном темпе
+    python replay.py updates.jsonl --speed 10 --compare replay_baseline.json
+
+Обновления одного пользователя обрабатываются по очереди, как при обычной работе бота.
+Тесты, на которые ведут ссылки из записи, заранее создаются во временной базе.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+
+import config
+from benchmark import compare_results, git_commit, latency_summary
+
+logger = logging.getLogger(__name__)
+
+# Автор тестов, созданных заранее для ссылок из записи
+REPLAY_CREATOR_ID = 1
+
+Record = Tuple[float, Dict[str, Any]]
+
+
+def load_records(path: str) -> List[Record]:
+    """Чтение записи в порядке получения обновлений"""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records.append((record["t"], record["u"]))
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+def referenced_test_ids(records: List[Record]) -> Set[str]:
+    """Идентификаторы тестов из ссылок вида /start <test_id>"""
+    test_ids = set()
+    for _, update in records:
+        text = update.get("message", {}).get("text", "")
+        parts = text.split()
+        if len(parts) > 1 and parts[0] == "/start":
+            test_ids.add(parts[1])
+    return test_ids
+
+
+async def run_replay(records: List[Record], speed: float, bot_latency: float,
+                     throttle: bool = False) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="replay_")
+    # Путь к базе нужно подменить до импорта database: путь по умолчанию читается при импорте
+    config.DATABASE_PATH = os.path.join(workdir, "replay.db")
+    # В ускоренном воспроизведении ограничение частоты отбросило бы часть записи
+    if not throttle:
+        config.THROTTLE_RATE = 0
+    from aiogram.types import Update
+    from bot import build_dispatcher, warm_up
+    from database import Database
+    from fakebot import make_fake_bot
+    from webhook import OrderedUpdateProcessor
+
+    db = Database()
+    await db.init_db()
+    bot = make_fake_bot(bot_latency)
+    dp = build_dispatcher(db)
+    throttling = dp.workflow_data.get("throttling")
+    await warm_up(bot, dp)
+
+    latencies: List[float] = []
+
+    async def measure(handler: Callable[..., Awaitable[Any]], event: Update, data: Dict[str, Any]):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            latencies.append(time.perf_counter() - started)
+    dp.update.outer_middleware(measure)
+
+    try:
+        await db.add_user(REPLAY_CREATOR_ID)
+        for test_id in referenced_test_ids(records):
+            await db.create_test(test_id, REPLAY_CREATOR_ID, "Тестовый", "160-179", "Карие", "Пауков")
+
+        processor = OrderedUpdateProcessor(bot, dp, config.WEBHOOK_MAX_CONCURRENT_UPDATES)
+        first_time = records[0][0] if records else 0.0
+        started = time.perf_counter()
+        for received_at, raw_update in records:
+            if speed > 0:
+                delay = (received_at - first_time) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            processor.submit(Update.model_validate(raw_update, context={"bot": bot}))
+        await processor.wait_closed()
+        elapsed = time.perf_counter() - started
+
+        return {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'params': {
+                'speed': speed, 'bot_latency': bot_latency, 'throttle_rate': config.THROTTLE_RATE,
+                'pool_size': config.DATABASE_POOL_SIZE,
+                'write_behind': config.WRITE_BEHIND_ENABLED,
+            },
+            'updates': len(records),
+            'recorded_seconds': round(records[-1][0] - first_time, 3) if records else 0.0,
+            'elapsed_seconds': round(elapsed, 3),
+            'updates_per_second': round(len(records) / elapsed, 1) if elapsed else 0.0,
+            'latency_ms': {'all': latency_summary(latencies)},
+            'failed': processor.failed,
+            'throttled': throttling.stats()['throttled'] if throttling else 0,
+            'bot_calls': len(bot.session.calls),
+        }
+    finally:
+        await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных обновлений")
+    parser.add_argument("records", help="Файл записи (RECORD_UPDATES_PATH)")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="Множитель скорости: 1 - исходный темп, 10 - в 10 раз быстрее, "
+                             "0 - без пауз")
+    parser.add_argument("--bot-latency", type=float, default=0.0,
+                        help="Имитация задержки ответа Telegram API, секунды")
+    parser.add_argument("--throttle", action="store_true",
+                        help="Ограничивать частоту обновлений пользователя, как в продакшене "
+                             "(имеет смысл при --speed 1)")
+    parser.add_argument("--output", help="Файл результата (по умолчанию replay_<commit>.json)")
+    parser.add_argument("--compare", help="Сравнить с сохранённым результатом")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    records = load_records(args.records)
+    result = asyncio.run(run_replay(records, args.speed, args.bot_latency, args.throttle))
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            result['comparison'] = compare_results(result, json.load(f))
+
+    output = args.output or f"replay_{result['commit']}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,142 @@
 """
 Модуль для рассылки сообщений подписчикам
 """
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from aiogram import Bot
+from broadcast import BroadcastEngine, BroadcastStats, smoothed_user_stream
 from database import Database
 import config
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Имя аренды, владелец которой выполняет рассылку
+BROADCAST_LEASE = 'broadcast_job'
+
 
 class BroadcastScheduler:
     """Класс для управления рассылкой сообщений"""
     
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: Bot, db: Optional[Database] = None):
         self.bot = bot
         self.scheduler = AsyncIOScheduler()
-        self.db = Database()
+        self.db = db or Database()
+        self.engine = BroadcastEngine(bot, on_unreachable=self.db.unsubscribe_users)
+        self._lock = asyncio.Lock()
+        # Уникальный идентификатор реплики для аренды лидерства
+        self.replica_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._broadcast_task: Optional[asyncio.Task] = None
+        self._resume_task: Optional[asyncio.Task] = None
     
-    async def broadcast_message(self):
-        """Отправка сообщения всем подписчикам"""
+    async def heartbeat(self):
+        """Захват или продление аренды лидерства"""
         try:
-            users = await self.db.get_all_subscribed_users()
-            logger.info(f"Starting broadcast to {len(users)} users")
-            
-            success_count = 0
-            error_count = 0
-            
-            for user_id in users:
-                try:
-                    await self.bot.send_message(
-                        user_id,
-                        config.BROADCAST_MESSAGE,
-                        reply_markup=None
-                    )
-                    success_count += 1
-                except Exception as e:
-                    logger.error(f"Error sending message to {user_id}: {e}")
-                    error_count += 1
-            
-            logger.info(f"Broadcast completed: {success_count} sent, {error_count} errors")
+            is_leader = await self.db.acquire_lease(
+                BROADCAST_LEASE, self.replica_id, config.LEADER_LEASE_TTL
+            )
         except Exception as e:
-            logger.error(f"Error in broadcast_message: {e}")
+            logger.error(f"Error renewing broadcast lease: {e}")
+            is_leader = False
+        
+        if is_leader and not self.is_leader:
+            logger.info(f"Replica {self.replica_id} became broadcast leader")
+            self.is_leader = True
+            # Новый лидер подхватывает рассылку, брошенную прежним
+            self._resume_task = asyncio.create_task(self.resume_broadcast())
+        elif not is_leader and self.is_leader:
+            logger.warning(f"Replica {self.replica_id} lost broadcast leadership")
+            self.is_leader = False
+            if self._broadcast_task is not None:
+                self._broadcast_task.cancel()
+    
+    async def broadcast_message(self):
+        """Отправка сообщения всем подписчикам (или продолжение прерванной рассылки)"""
+        await self.heartbeat()
+        if not self.is_leader:
+            logger.info("Not a broadcast leader, skipping broadcast")
+            return
+        if self._lock.locked():
+            logger.warning("Previous broadcast is still running, skipping")
+            return
+        async with self._lock:
+            self._broadcast_task = asyncio.current_task()
+            try:
+                await self._run_job()
+            except asyncio.CancelledError:
+                # Прогресс сохранён в контрольной точке, рассылку продолжит новый лидер
+                logger.warning("Broadcast interrupted")
+            except Exception as e:
+                logger.error(f"Error in broadcast_message: {e}")
+            finally:
+                self._broadcast_task = None
+    
+    async def resume_broadcast(self):
+        """Продолжение незавершённой рассылки после перезапуска"""
+        if await self.db.get_unfinished_broadcast_job():
+            await self.broadcast_message()
+    
+    async def _run_job(self):
+        """Выполнение задания рассылки с сохранением прогресса"""
+        job = await self.db.get_unfinished_broadcast_job()
+        if job:
+            logger.info(
+                f"Resuming broadcast job {job['job_id']} after user {job['cursor_user_id']} "
+                f"({job['sent']} already sent)"
+            )
+        else:
+            # Таймер у каждой реплики свой: новый лидер не должен начать рассылку
+            # в том же периоде, что и предыдущая, запущенная другой репликой
+            age = await self.db.get_last_broadcast_age()
+            if age is not None and age < config.BROADCAST_MIN_GAP:
+                logger.info(f"Last broadcast started {age:.0f}s ago, skipping until the next period")
+                return
+            job_id = await self.db.create_broadcast_job(
+                config.BROADCAST_MESSAGE, mode=config.BROADCAST_MODE
+            )
+            job = await self.db.get_broadcast_job(job_id)
+            logger.info(f"Starting broadcast job {job_id} ({job['mode']})")
+        
+        async def checkpoint(cursor_user_id: int, stats: BroadcastStats):
+            # Счётчики задания накопительные с учётом прошлых запусков
+            await self.db.checkpoint_broadcast_job(
+                job['job_id'], cursor_user_id,
+                sent=job['sent'] + stats.sent,
+                failed=job['failed'] + stats.failed,
+                unreachable=job['unreachable'] + stats.unreachable
+            )
+        
+        if job['mode'] == 'smoothed':
+            # Слоты отсчитываются от начала задания, в том числе после перезапуска
+            started_at = datetime.strptime(job['started_at'], '%Y-%m-%d %H:%M:%S')
+            users = smoothed_user_stream(
+                self.db,
+                started_at=started_at.replace(tzinfo=timezone.utc).timestamp(),
+                window=config.BROADCAST_INTERVAL * config.BROADCAST_SMOOTHING_WINDOW,
+                after_user_id=job['cursor_user_id']
+            )
+        else:
+            users = self.db.iter_subscribed_users(after_user_id=job['cursor_user_id'])
+        stats = await self.engine.run(users, job['message'], checkpoint=checkpoint)
+        await self.db.finish_broadcast_job(job['job_id'])
+        
+        logger.info(
+            f"Broadcast job {job['job_id']} completed: {stats.sent} sent, {stats.failed} errors, "
+            f"{stats.unreachable} unreachable unsubscribed, "
+            f"{stats.retries} retries, {stats.rate:.1f} msg/s in {stats.elapsed:.1f}s "
+            f"(peak {stats.peak_rate} msg/s)"
+        )
+        series = ", ".join(f"{rate:.1f}" for rate in stats.rate_series())
+        logger.info(f"Broadcast send rate by minute (msg/s): [{series}]")
+        if stats.errors:
+            logger.info(f"Broadcast errors by type: {dict(stats.errors)}")
     
     def start(self):
         """Запуск планировщика рассылки"""
@@ -53,6 +147,15 @@ class BroadcastScheduler:
             id='broadcast_job',
             replace_existing=True
         )
+        # Аренда лидерства: первый захват сразу после старта, дальше - продление.
+        # Став лидером, реплика продолжает рассылку, прерванную перезапуском
+        self.scheduler.add_job(
+            self.heartbeat,
+            trigger=IntervalTrigger(seconds=config.LEADER_HEARTBEAT_INTERVAL),
+            id='broadcast_lease_heartbeat',
+            next_run_time=datetime.now(),
+            replace_existing=True
+        )
         self.scheduler.start()
         logger.info("Broadcast scheduler started")
     
@@ -60,4 +163,20 @@ class BroadcastScheduler:
         """Остановка планировщика"""
         self.scheduler.shutdown()
         logger.info("Broadcast scheduler stopped")
+    
+    async def release_leadership(self):
+        """
+        Освобождение аренды, чтобы другая реплика сразу стала лидером.
+        Сначала останавливается текущая рассылка: новый лидер продолжит её
+        с последней контрольной точки, и сообщения не уйдут дважды
+        """
+        if self.is_leader:
+            self.is_leader = False
+            for task in (self._resume_task, self._broadcast_task):
+                if task is not None and not task.done():
+                    task.cancel()
+                    # Рассылка перехватывает отмену и перед выходом сохраняет прогресс
+                    await asyncio.gather(task, return_exceptions=True)
+            await self.db.release_lease(BROADCAST_LEASE, self.replica_id)
+            logger.info(f"Replica {self.replica_id} released broadcast leadership")
 
@@ -0,0 +1,131 @@
+"""
+Подсчёт результата прохождения теста и компактное кодирование ответов
+"""
+from typing import Dict, List, Mapping, NamedTuple, Optional, Sequence
+
+from keyboards import EYE_COLOR_OPTIONS, FEAR_OPTIONS, HEIGHT_OPTIONS
+
+try:
+    import numpy as np
+except ImportError:  # NumPy нужен только для ускорения пакетного подсчёта
+    np = None
+
+# Постоянные коды вариантов ответа (1..7, 0 - нет ответа). Коды хранятся в базе
+# в answers_packed, поэтому у варианта код не меняется никогда: новый вариант
+# получает следующий свободный код, код удалённого варианта не переиспользуется
+OPTION_CODES = {
+    'height_range': {"140-159": 1, "160-179": 2, "180-199": 3, "200+": 4},
+    'eye_color': {"Карие": 1, "Голубые": 2, "Зелёные": 3, "Серые": 4},
+    'fear': {"Высоты": 1, "Темноты": 2, "Пауков": 3, "Одиночества": 4},
+}
+CHOICE_FIELDS = tuple(OPTION_CODES)
+
+# Всего вопросов: имя + вопросы с выбором варианта
+TOTAL_QUESTIONS = 1 + len(CHOICE_FIELDS)
+
+# Код ответа на вопрос с выбором хранится в своей группе битов одного целого числа answers_packed
+FIELD_BITS = 3
+FIELD_MASK = (1 << FIELD_BITS) - 1
+FIELD_SHIFTS = {field: index * FIELD_BITS for index, field in enumerate(CHOICE_FIELDS)}
+
+_OPTIONS_BY_CODE = {
+    field: {code: option for option, code in codes.items()}
+    for field, codes in OPTION_CODES.items()
+}
+
+assert all(0 < code <= FIELD_MASK for codes in OPTION_CODES.values() for code in codes.values())
+assert all(len(_OPTIONS_BY_CODE[field]) == len(codes) for field, codes in OPTION_CODES.items())
+# Каждому варианту на клавиатуре нужен свой код
+assert all(
+    set(options) <= set(OPTION_CODES[field])
+    for field, options in (
+        ('height_range', HEIGHT_OPTIONS), ('eye_color', EYE_COLOR_OPTIONS), ('fear', FEAR_OPTIONS),
+    )
+)
+
+
+class Score(NamedTuple):
+    """Результат прохождения теста"""
+    matches: int
+    total: int
+    percentage: int
+
+
+def pack_answers(answer: Mapping) -> int:
+    """Упаковка ответов на вопросы с выбором в одно число (неизвестный вариант - ValueError)"""
+    packed = 0
+    for field, shift in FIELD_SHIFTS.items():
+        value = answer.get(field)
+        if value is None:
+            continue
+        code = OPTION_CODES[field].get(value)
+        if code is None:
+            raise ValueError(f"Unknown {field} answer: {value!r}")
+        packed |= code << shift
+    return packed
+
+
+def unpack_answers(packed: int) -> Dict[str, Optional[str]]:
+    """Распаковка ответов на вопросы с выбором"""
+    answer = {}
+    for field, shift in FIELD_SHIFTS.items():
+        code = (packed >> shift) & FIELD_MASK
+        answer[field] = _OPTIONS_BY_CODE[field][code] if code else None
+    return answer
+
+
+def _names_match(test_name: Optional[str], answer_name: Optional[str]) -> bool:
+    # Имя сравниваем без учёта регистра
+    return (answer_name or '').lower() == (test_name or '').lower()
+
+
+def _choice_matches(test_packed: int, answer_packed: int) -> int:
+    """Число совпавших ответов на вопросы с выбором"""
+    diff = test_packed ^ answer_packed
+    return sum(1 for shift in FIELD_SHIFTS.values() if not (diff >> shift) & FIELD_MASK)
+
+
+def _make_score(matches: int) -> Score:
+    percentage = int((matches / TOTAL_QUESTIONS) * 100)
+    return Score(matches, TOTAL_QUESTIONS, percentage)
+
+
+def score_answer(test: Mapping, answer: Mapping) -> Score:
+    """Сравнение ответов друга с ответами автора теста"""
+    test_packed = test.get('answers_packed')
+    if test_packed is None:
+        test_packed = pack_answers(test)
+    answer_packed = answer.get('answers_packed')
+    if answer_packed is None:
+        answer_packed = pack_answers(answer)
+
+    matches = _choice_matches(test_packed, answer_packed)
+    if _names_match(test.get('name'), answer.get('name')):
+        matches += 1
+    return _make_score(matches)
+
+
+def score_batch(test: Mapping, answers_packed: Sequence[int],
+                names: Sequence[Optional[str]]) -> List[Score]:
+    """
+    Подсчёт результатов пачки ответов на один тест. Вопросы с выбором
+    сравниваются одним проходом битовых операций (векторно, если есть NumPy).
+    """
+    test_packed = test.get('answers_packed')
+    if test_packed is None:
+        test_packed = pack_answers(test)
+
+    if np is not None:
+        diff = np.asarray(answers_packed, dtype=np.int64) ^ test_packed
+        choice_matches = np.zeros(len(diff), dtype=np.int64)
+        for shift in FIELD_SHIFTS.values():
+            choice_matches += ((diff >> shift) & FIELD_MASK) == 0
+        choice_matches = choice_matches.tolist()
+    else:
+        choice_matches = [_choice_matches(test_packed, packed) for packed in answers_packed]
+
+    test_name = test.get('name')
+    return [
+        _make_score(matches + _names_match(test_name, name))
+        for matches, name in zip(choice_matches, names)
+    ]
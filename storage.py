@@ -0,0 +1,125 @@
+"""
+Хранилище состояний FSM в SQLite
+"""
+import json
+import logging
+import time
+from typing import Any, Dict, NamedTuple, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import config
+from cache import LRUCache
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class FSMRecord(NamedTuple):
+    """Состояние диалога и его данные"""
+    state: Optional[str]
+    data: Dict[str, Any]
+    updated_at: float
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в SQLite: незаконченные диалоги переживают перезапуск.
+    Записи кэшируются в памяти (запись - сразу и в кэш, и в базу), поэтому чтение
+    состояния на каждом сообщении не ходит в базу. Диалоги, не менявшиеся дольше ttl
+    секунд, считаются брошенными и удаляются.
+
+    Кэш не согласуется между процессами: запись из кэша считается актуальной
+    cache_ttl секунд, потом перечитывается из базы (0 - кэш выключен).
+    """
+
+    def __init__(self, db: Optional[Database] = None,
+                 ttl: float = config.FSM_STATE_TTL,
+                 cache_size: int = config.FSM_CACHE_SIZE,
+                 cache_ttl: float = config.FSM_CACHE_TTL):
+        self.db = db or Database()
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        # storage_key -> (запись, время помещения в кэш по time.monotonic())
+        self.cache = LRUCache(cache_size)
+        self._purged_at = time.time()
+
+    @staticmethod
+    def _storage_key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    def _cache_put(self, storage_key: str, record: FSMRecord):
+        if self.cache_ttl > 0:
+            self.cache.put(storage_key, (record, time.monotonic()))
+
+    def _cached(self, storage_key: str) -> Optional[FSMRecord]:
+        """Актуальная запись из кэша (None - нет в кэше или устарела)"""
+        cached = self.cache.get(storage_key)
+        if cached is not None and time.monotonic() - cached[1] < self.cache_ttl:
+            return cached[0]
+        return None
+
+    async def _load(self, key: StorageKey) -> FSMRecord:
+        """Запись из кэша, при промахе или устаревании - из базы (отсутствие записи тоже кэшируется)"""
+        storage_key = self._storage_key(key)
+        record = self._cached(storage_key)
+        if record is None:
+            row = await self.db.get_fsm_record(storage_key)
+            if row:
+                record = FSMRecord(row['state'], json.loads(row['data']), row['updated_at'])
+            else:
+                record = FSMRecord(None, {}, time.time())
+            self._cache_put(storage_key, record)
+        
+        if record.state is not None and time.time() - record.updated_at > self.ttl:
+            # Брошенный диалог - начинаем с чистого листа
+            record = FSMRecord(None, {}, time.time())
+            self._cache_put(storage_key, record)
+        return record
+
+    async def _save(self, key: StorageKey, state: Optional[str], data: Dict[str, Any],
+                    current: Optional[FSMRecord]):
+        """
+        Запись в кэш и в базу одним запросом. Пустую запись поверх пустой не пишем
+        (current - известная текущая запись, None - неизвестна)
+        """
+        if state is None and not data and current is not None and current.state is None \
+                and not current.data:
+            return
+        storage_key = self._storage_key(key)
+        now = time.time()
+        self._cache_put(storage_key, FSMRecord(state, data, now))
+        if state is None and not data:
+            await self.db.delete_fsm_record(storage_key)
+        else:
+            await self.db.save_fsm_record(storage_key, state, json.dumps(data), now)
+        
+        if now - self._purged_at > config.FSM_PURGE_INTERVAL:
+            self._purged_at = now
+            purged = await self.db.purge_fsm_records(now - self.ttl)
+            if purged:
+                logger.info(f"Purged {purged} abandoned FSM states")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._load(key)
+        await self._save(key, state.state if isinstance(state, State) else state, record.data, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._load(key)
+        await self._save(key, record.state, data.copy(), record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._load(key)).data.copy()
+
+    async def set_state_and_data(self, key: StorageKey, state: StateType,
+                                 data: Dict[str, Any]) -> None:
+        """Смена состояния и данных одной записью (новые данные уже известны - без чтения)"""
+        current = self._cached(self._storage_key(key))
+        await self._save(key, state.state if isinstance(state, State) else state, data.copy(), current)
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,13 @@
+"""
+Общая настройка тестов: модули бота импортируются из корня репозитория,
+а база - временная (обработчики создают Database() при импорте)
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+config.DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix="friends_test_bot_tests_"), "bot.db")
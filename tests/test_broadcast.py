@@ -0,0 +1,214 @@
+"""
+Движок рассылки: ограничение параллельности, повторы и статистика
+"""
+import asyncio
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+)
+from aiogram.methods import TelegramMethod
+
+from broadcast import BroadcastEngine
+from database import Database
+from fakebot import FAKE_BOT_TOKEN, RecordingSession
+from outbound import setup_outbound
+
+
+class FailingSession(RecordingSession):
+    """RecordingSession, которая для заданных чатов сначала отвечает ошибками из failures"""
+
+    def __init__(self, failures: Dict[int, List[Exception]], latency: float = 0.0):
+        super().__init__(latency)
+        self.failures = failures
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None):
+        errors = self.failures.get(getattr(method, 'chat_id', None))
+        if errors:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            raise errors.pop(0)
+        return await super().make_request(bot, method, timeout)
+
+
+def make_bot(session: RecordingSession) -> Bot:
+    return Bot(token=FAKE_BOT_TOKEN, session=session, parse_mode="HTML")
+
+
+async def users(*user_ids: int):
+    for user_id in user_ids:
+        yield user_id
+
+
+def retry_after(seconds: int) -> TelegramRetryAfter:
+    return TelegramRetryAfter(method=None, message="Flood control exceeded", retry_after=seconds)
+
+
+def network_error() -> TelegramNetworkError:
+    return TelegramNetworkError(method=None, message="Request timeout error")
+
+
+def record_sleeps(monkeypatch) -> List[float]:
+    """Подмена asyncio.sleep: паузы записываются, но не выжидаются"""
+    sleeps: List[float] = []
+    original_sleep = asyncio.sleep
+
+    async def sleep(delay, *args, **kwargs):
+        sleeps.append(delay)
+        await original_sleep(0)
+
+    monkeypatch.setattr(asyncio, 'sleep', sleep)
+    return sleeps
+
+
+def test_retry_after_is_waited_out_without_outbound_limiter(monkeypatch):
+    sleeps = record_sleeps(monkeypatch)
+    session = FailingSession({1: [retry_after(7)]})
+
+    stats = asyncio.run(BroadcastEngine(make_bot(session)).run(users(1), "text"))
+
+    assert (stats.sent, stats.retries, stats.failed) == (1, 1, 0)
+    assert 7 in sleeps
+
+
+def test_retry_after_pauses_outbound_limiter_instead_of_engine(monkeypatch):
+    session = FailingSession({1: [retry_after(7)]})
+    bot = make_bot(session)
+
+    async def run():
+        limiter = setup_outbound(bot)
+        paused = []
+        monkeypatch.setattr(limiter, 'pause', paused.append)
+        sleeps = record_sleeps(monkeypatch)
+        stats = await BroadcastEngine(bot).run(users(1), "text")
+        return stats, paused, sleeps
+
+    stats, paused, sleeps = asyncio.run(run())
+
+    assert (stats.sent, stats.retries) == (1, 1)
+    assert paused == [7]
+    assert 7 not in sleeps
+
+
+class ConcurrencySession(RecordingSession):
+    """RecordingSession, которая запоминает наибольшее число одновременных запросов"""
+
+    def __init__(self, latency: float):
+        super().__init__(latency)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await super().make_request(bot, method, timeout)
+        finally:
+            self.in_flight -= 1
+
+
+def test_sends_are_bounded_by_concurrency():
+    session = ConcurrencySession(latency=0.01)
+    engine = BroadcastEngine(make_bot(session), concurrency=4)
+
+    stats = asyncio.run(engine.run(users(*range(1, 41)), "text"))
+
+    assert stats.sent == 40
+    assert session.max_in_flight == 4
+    assert sorted(call.chat_id for call in session.calls) == list(range(1, 41))
+
+
+def test_network_errors_are_retried_with_backoff(monkeypatch):
+    sleeps = record_sleeps(monkeypatch)
+    session = FailingSession({1: [network_error(), network_error()]})
+
+    stats = asyncio.run(BroadcastEngine(make_bot(session), max_retries=3).run(users(1), "text"))
+
+    assert (stats.sent, stats.retries, stats.failed) == (1, 2, 0)
+    assert [delay for delay in sleeps if delay] == [1, 2]
+
+
+def test_stats_count_every_outcome(monkeypatch):
+    record_sleeps(monkeypatch)
+    session = FailingSession({
+        2: [retry_after(1)],
+        3: [network_error(), network_error(), network_error()],
+        4: [TelegramForbiddenError(method=None, message="Forbidden: bot was blocked by the user")],
+        5: [TelegramBadRequest(method=None, message="Bad Request: message is too long")],
+    })
+    engine = BroadcastEngine(make_bot(session), max_retries=2)
+
+    stats = asyncio.run(engine.run(users(1, 2, 3, 4, 5), "text"))
+
+    assert (stats.sent, stats.failed, stats.unreachable) == (2, 2, 1)
+    # Повторы: один после флуд-контроля и два после сбоев сети (третья попытка - последняя)
+    assert stats.retries == 3
+    assert stats.errors == {
+        'TelegramNetworkError': 1, 'TelegramForbiddenError': 1, 'TelegramBadRequest': 1,
+    }
+    assert sum(stats.sent_per_second.values()) == stats.sent
+    assert stats.peak_rate == stats.sent
+    assert stats.finished_at is not None and stats.rate > 0
+
+
+def blocked() -> TelegramForbiddenError:
+    return TelegramForbiddenError(method=None, message="Forbidden: bot was blocked by the user")
+
+
+def test_unreachable_users_are_pruned_in_batches(tmp_path):
+    session = FailingSession({user_id: [blocked()] for user_id in (2, 3, 4, 6, 7)})
+
+    async def run():
+        db = Database(str(tmp_path / "prune.db"))
+        await db.init_db()
+        try:
+            for user_id in range(1, 9):
+                await db.add_user(user_id)
+            batches = []
+
+            async def on_unreachable(user_ids):
+                batches.append(sorted(user_ids))
+                await db.unsubscribe_users(user_ids)
+
+            engine = BroadcastEngine(make_bot(session), concurrency=1,
+                                     on_unreachable=on_unreachable, prune_batch_size=2)
+            stats = await engine.run(db.iter_subscribed_users(), "text")
+            subscribed = [user_id async for user_id in db.iter_subscribed_users()]
+        finally:
+            await db.close()
+        return stats, batches, subscribed
+
+    stats, batches, subscribed = asyncio.run(run())
+
+    assert stats.unreachable == 5
+    # Полные пачки - по мере заполнения, остаток - в конце рассылки
+    assert batches == [[2, 3], [4, 6], [7]]
+    assert subscribed == [1, 5, 8]
+
+
+class ShuffledLatencySession(RecordingSession):
+    """RecordingSession, в которой отправки завершаются не в порядке ID"""
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None):
+        chat_id = getattr(method, 'chat_id', 0)
+        await asyncio.sleep((chat_id * 7 % 5) / 1000)
+        return await super().make_request(bot, method, timeout)
+
+
+def test_checkpoint_cursor_covers_only_processed_prefix():
+    session = ShuffledLatencySession()
+    checkpoints = []
+
+    async def checkpoint(cursor, stats):
+        sent = {call.chat_id for call in session.calls}
+        checkpoints.append(cursor)
+        # Все пользователи до курсора включительно уже получили сообщение
+        assert set(range(1, cursor + 1)) <= sent
+
+    engine = BroadcastEngine(make_bot(session), concurrency=4)
+    asyncio.run(engine.run(users(*range(1, 31)), "text", checkpoint=checkpoint, checkpoint_every=3))
+
+    assert checkpoints == sorted(checkpoints)
+    assert len(checkpoints) > 2
+    assert checkpoints[-1] == 30
@@ -0,0 +1,142 @@
+"""
+Запросы к тестам: агрегаты прохождений, рейтинг друзей и постраничный список
+"""
+import asyncio
+import sqlite3
+
+from database import Database
+
+TEST_ID = "test_000000000001"
+# Ответы автора теста
+TEST_ANSWERS = {'name': "Маша", 'height_range': "160-179", 'eye_color': "Зелёные", 'fear': "Пауков"}
+# Ответы, не совпадающие ни с одним ответом автора
+WRONG_ANSWERS = {'name': "Петя", 'height_range': "200+", 'eye_color': "Карие", 'fear': "Высоты"}
+
+
+def answer(matches: int):
+    """Ответ друга, в котором совпадают первые matches ответов из 4"""
+    return {
+        field: (TEST_ANSWERS if index < matches else WRONG_ANSWERS)[field]
+        for index, field in enumerate(TEST_ANSWERS)
+    }
+
+
+def run_with_db(tmp_path, scenario):
+    """Сценарий над новой базой с пользователями 1-9 и тестом TEST_ID автора 1"""
+    async def run():
+        db = Database(str(tmp_path / "tests.db"))
+        await db.init_db()
+        try:
+            for user_id in range(1, 10):
+                await db.add_user(user_id, first_name=f"Друг {user_id}")
+            await db.create_test(TEST_ID, 1, TEST_ANSWERS['name'], TEST_ANSWERS['height_range'],
+                                 TEST_ANSWERS['eye_color'], TEST_ANSWERS['fear'])
+            return await scenario(db)
+        finally:
+            await db.close()
+    return asyncio.run(run())
+
+
+def test_test_stats_follow_saved_answers(tmp_path):
+    async def scenario(db):
+        assert await db.get_test_stats(TEST_ID) is None
+        for user_id, matches in ((2, 4), (3, 1), (4, 2), (5, 2)):
+            await db.save_test_answer(TEST_ID, user_id, **answer(matches))
+        stats = await db.get_test_stats(TEST_ID)
+        # Пересчёт по сырым ответам даёт те же агрегаты
+        await db.rebuild_test_stats()
+        assert await db.get_test_stats(TEST_ID) == stats
+        return stats
+
+    stats = run_with_db(tmp_path, scenario)
+
+    assert stats['completions'] == 4
+    assert stats['best_score'] == 100
+    assert stats['mean_score'] == (100 + 25 + 50 + 50) / 4
+    assert stats['histogram'] == [0, 1, 2, 0, 1]
+
+
+def set_created_at(db: Database, table: str, key: str, created_at: dict):
+    """Явное время создания строк (CURRENT_TIMESTAMP различает только секунды)"""
+    with sqlite3.connect(db.db_path) as connection:
+        connection.executemany(
+            f"UPDATE {table} SET created_at = ? WHERE {key} = ?",
+            [(timestamp, row_key) for row_key, timestamp in created_at.items()]
+        )
+
+
+def test_leaderboard_keeps_best_attempt_per_friend(tmp_path):
+    # (друг, совпадений, время ответа)
+    attempts = [
+        (2, 2, "2026-01-01 10:00:00"),
+        (3, 4, "2026-01-01 10:01:00"),
+        (2, 4, "2026-01-01 10:02:00"),
+        (4, 3, "2026-01-01 10:03:00"),
+        (4, 3, "2026-01-01 10:04:00"),
+        (5, 1, "2026-01-01 10:05:00"),
+        (3, 1, "2026-01-01 10:06:00"),
+    ]
+
+    async def scenario(db):
+        for user_id, matches, _ in attempts:
+            await db.save_test_answer(TEST_ID, user_id, **answer(matches))
+        set_created_at(db, "test_answers", "answer_id", {
+            answer_id: created_at for answer_id, (_, _, created_at) in enumerate(attempts, start=1)
+        })
+        return await db.get_test_leaderboard(TEST_ID), await db.get_test_leaderboard(TEST_ID, limit=2)
+
+    leaders, top_two = run_with_db(tmp_path, scenario)
+
+    # При равном результате выше тот, кто набрал его раньше
+    assert [(leader['user_id'], leader['percentage'], leader['created_at']) for leader in leaders] == [
+        (3, 100, "2026-01-01 10:01:00"),
+        (2, 100, "2026-01-01 10:02:00"),
+        (4, 75, "2026-01-01 10:03:00"),
+        (5, 25, "2026-01-01 10:05:00"),
+    ]
+    assert leaders[0]['first_name'] == "Друг 3"
+    assert top_two == leaders[:2]
+
+
+def test_user_tests_pages_are_keyset_ordered(tmp_path):
+    # Тесты автора 2 от старых к новым; у части одинаковое время создания
+    created_at = {
+        "test_a00000000001": "2026-01-01 10:00:00",
+        "test_a00000000002": "2026-01-01 10:00:00",
+        "test_a00000000003": "2026-01-01 11:00:00",
+        "test_a00000000004": "2026-01-01 11:00:00",
+        "test_a00000000005": "2026-01-01 11:00:00",
+        "test_a00000000006": "2026-01-01 12:00:00",
+        "test_a00000000007": "2026-01-01 13:00:00",
+    }
+
+    def ids(page):
+        tests, has_more = page
+        return [test['test_id'][-1:] for test in tests], has_more
+
+    async def scenario(db):
+        for test_id in created_at:
+            await db.create_test(test_id, 2, "Петя", "200+", "Карие", "Высоты")
+        set_created_at(db, "tests", "test_id", created_at)
+        return [
+            ids(await db.get_user_tests_page(2, limit=3)),
+            ids(await db.get_user_tests_page(2, limit=3, after_test_id="test_a00000000005")),
+            ids(await db.get_user_tests_page(2, limit=3, after_test_id="test_a00000000002")),
+            ids(await db.get_user_tests_page(2, limit=3, before_test_id="test_a00000000001")),
+            ids(await db.get_user_tests_page(2, limit=3, before_test_id="test_a00000000004")),
+            ids(await db.get_user_tests_page(2, limit=3, before_test_id="test_a00000000007")),
+            ids(await db.get_user_tests_page(3, limit=3)),
+        ]
+
+    first, second, last, back_to_second, back_to_first, before_first, empty = (
+        run_with_db(tmp_path, scenario)
+    )
+
+    # От новых к старым; при равном времени порядок задаёт test_id
+    assert first == (["7", "6", "5"], True)
+    assert second == (["4", "3", "2"], True)
+    assert last == (["1"], False)
+    assert back_to_second == (["4", "3", "2"], True)
+    assert back_to_first == (["7", "6", "5"], False)
+    assert before_first == ([], False)
+    assert empty == ([], False)
@@ -0,0 +1,84 @@
+"""
+Анкета: выбор шага по состоянию FSM, проверка ответов и завершение
+"""
+import asyncio
+
+from aiogram import Dispatcher, Router
+from aiogram.types import Update
+
+from database import Database
+from fakebot import make_fake_bot
+from flows import QUESTIONS, Questionnaire, clear_state
+from states import CreateTestStates
+from storage import SQLiteStorage
+
+USER_ID = 5
+
+
+def make_update(update_id: int, text: str) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": USER_ID, "type": "private"},
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Аня"},
+            "text": text,
+        },
+    })
+
+
+def test_questionnaire_walks_steps_and_completes(tmp_path):
+    completed = []
+
+    async def on_complete(message, state, data):
+        completed.append(data)
+        await clear_state(state)
+
+    async def run():
+        db = Database(str(tmp_path / "flows.db"))
+        await db.init_db()
+        try:
+            router = Router()
+            questionnaire = Questionnaire(router, 'create', CreateTestStates, on_complete)
+            dp = Dispatcher(storage=SQLiteStorage(db))
+            dp.include_router(router)
+            bot = make_fake_bot()
+            state = dp.fsm.get_context(bot, chat_id=USER_ID, user_id=USER_ID)
+            await state.set_state(questionnaire.states[0])
+
+            steps = []
+            answers = ["Маша", "300+", "160-179", "Зелёные", "Пауков"]
+            for update_id, text in enumerate(answers):
+                await dp.feed_update(bot, make_update(update_id, text))
+                steps.append(await state.get_state())
+            return bot.session.calls, steps, await state.get_data()
+        finally:
+            await db.close()
+
+    calls, steps, data_after = asyncio.run(run())
+
+    states = [state.state for state in CreateTestStates.__all_states__]
+    # Некорректный рост не сдвигает анкету, после последнего ответа диалог закончен
+    assert steps == [states[1], states[1], states[2], states[3], None]
+    assert [call.text for call in calls] == [
+        "📏 <b>Вопрос 2 из 4:</b>\nКакой у тебя рост?",
+        QUESTIONS[1].invalid_text,
+        "👁️ <b>Вопрос 3 из 4:</b>\nКакого цвета у тебя глаза?",
+        "😰 <b>Вопрос 4 из 4:</b>\nЧего ты боишься больше всего?",
+    ]
+    assert calls[0].reply_markup == QUESTIONS[1].keyboard
+    assert completed == [
+        {'name': "Маша", 'height_range': "160-179", 'eye_color': "Зелёные", 'fear': "Пауков"}
+    ]
+    assert data_after == {}
+
+
+def test_question_parse():
+    name, height = QUESTIONS[0], QUESTIONS[1]
+    assert name.parse("  Маша  ") == "Маша"
+    assert name.parse("   ") is None
+    assert name.parse("я" * 101) is None
+    assert name.parse(None) is None
+    assert height.parse("160-179") == "160-179"
+    assert height.parse("160") is None
@@ -0,0 +1,65 @@
+"""
+Метрики: замер методов экземпляра Database и группировка строк по метрике
+"""
+import asyncio
+
+from database import Database
+from metrics import DATABASE_DURATION, Registry, instrument_database
+
+
+def observations(method: str) -> int:
+    series = DATABASE_DURATION.values.get((method,))
+    return series[2] if series else 0
+
+
+def test_instrument_database_times_instance_coroutines_and_generators(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "metrics.db"))
+        other = Database(str(tmp_path / "metrics.db"))
+        await db.init_db()
+        try:
+            instrument_database(db)
+            instrument_database(db)
+            before = {
+                name: observations(name) for name in ('add_user', 'iter_subscribed_users')
+            }
+
+            for user_id in (1, 2, 3):
+                await db.add_user(user_id)
+            await other.add_user(4)
+            users = db.iter_subscribed_users(chunk_size=2)
+            assert await users.__anext__() == 1
+            # Выборка ещё не исчерпана - время не записано
+            assert observations('iter_subscribed_users') == before['iter_subscribed_users']
+            rest = [user_id async for user_id in users]
+        finally:
+            await db.close()
+        return before, rest
+
+    before, rest = asyncio.run(run())
+
+    assert rest == [2, 3, 4]
+    # Повторное подключение не оборачивает методы дважды, другие экземпляры не замеряются
+    assert observations('add_user') == before['add_user'] + 3
+    assert observations('iter_subscribed_users') == before['iter_subscribed_users'] + 1
+    assert 'add_user' not in vars(Database(str(tmp_path / "metrics.db")))
+
+
+def test_collector_samples_are_grouped_by_metric():
+    registry = Registry()
+    for shard in ("0", "1"):
+        registry.add_collector(f"worker_{shard}", lambda shard=shard: [
+            ("bot_worker_pending", {'shard': shard}, 1),
+            ("bot_worker_processed", {'shard': shard}, 2),
+        ])
+
+    lines = registry.render().splitlines()
+
+    assert lines == [
+        "# TYPE bot_worker_pending gauge",
+        'bot_worker_pending{shard="0"} 1.0',
+        'bot_worker_pending{shard="1"} 1.0',
+        "# TYPE bot_worker_processed gauge",
+        'bot_worker_processed{shard="0"} 2.0',
+        'bot_worker_processed{shard="1"} 2.0',
+    ]
@@ -0,0 +1,51 @@
+"""
+Общий слой отправки: приоритет ответов пользователям над рассылкой
+"""
+import asyncio
+
+from outbound import OutboundLimiter, Priority
+
+
+def test_interactive_sends_go_ahead_of_queued_bulk():
+    async def run():
+        limiter = OutboundLimiter(rate=50, bulk_reserve=0)
+        limiter.bucket.tokens = 0.0
+        order = []
+
+        async def send(name, priority):
+            await limiter.acquire(priority)
+            order.append(name)
+
+        bulk = [asyncio.create_task(send(f"bulk-{index}", Priority.BULK)) for index in range(5)]
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(send("interactive", Priority.INTERACTIVE))
+        await asyncio.gather(*bulk, interactive)
+        return order, limiter
+
+    order, limiter = asyncio.run(run())
+
+    # Ответ пользователю пришёл последним, но получил первый освободившийся токен
+    assert order[0] == "interactive"
+    assert order[1:] == [f"bulk-{index}" for index in range(5)]
+    assert limiter.sent == {Priority.INTERACTIVE: 1, Priority.BULK: 5}
+
+
+def test_bulk_sends_leave_reserve_for_interactive():
+    async def run():
+        limiter = OutboundLimiter(rate=10, bulk_reserve=3)
+        for _ in range(7):
+            await limiter.acquire(Priority.BULK)
+        assert limiter.wait_time_max[Priority.BULK] == 0
+
+        # Рассылка упёрлась в резерв и ждёт, а ответ пользователю уходит сразу
+        blocked_bulk = asyncio.create_task(limiter.acquire(Priority.BULK))
+        await asyncio.sleep(0)
+        assert limiter.queued[Priority.BULK] == 1
+        await limiter.acquire(Priority.INTERACTIVE)
+        assert limiter.wait_time_max[Priority.INTERACTIVE] == 0
+        assert not blocked_bulk.done()
+
+        blocked_bulk.cancel()
+        await asyncio.gather(blocked_bulk, return_exceptions=True)
+
+    asyncio.run(run())
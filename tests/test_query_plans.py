@@ -0,0 +1,103 @@
+"""
+Планы запросов Database: каждый запрос, который выполняют методы, проверяется
+через EXPLAIN QUERY PLAN и не должен читать таблицу целиком
+"""
+import asyncio
+import inspect
+import sqlite3
+import time
+
+from database import Database
+from migrations import BROADCAST_SLOTS
+
+# Методы, которые не выполняют запросов к данным
+NOT_QUERIES = {'init_db', 'open_pool', 'close'}
+
+# Полный обход подписчиков для рассылки - по частичному индексу, а не по таблице
+ALLOWED_SCANS = ("SCAN users USING COVERING INDEX idx_users_subscribed",)
+
+DATA_STATEMENTS = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+
+async def exercise(db: Database) -> set:
+    """Вызов всех методов Database, возвращает имена вызванных"""
+    called = set()
+
+    def call(name):
+        called.add(name)
+        return getattr(db, name)
+
+    creator_id, friend_id = 1, BROADCAST_SLOTS + 1
+    await call('add_user')(creator_id, "creator", "Аня")
+    await call('add_user')(friend_id, "friend", "Боря")
+    for index in range(4):
+        await call('create_test')(f"test{index}", creator_id, "Аня", "160-179", "Карие", "Пауков")
+    await call('get_test')("test0")
+    first_page, _ = await call('get_user_tests_page')(creator_id, limit=2)
+    await db.get_user_tests_page(creator_id, limit=2, after_test_id=first_page[-1]['test_id'])
+    await db.get_user_tests_page(creator_id, limit=2, before_test_id=first_page[-1]['test_id'])
+
+    await call('save_test_answer')("test0", friend_id, "Аня", "160-179", "Карие", "Пауков")
+    await call('get_test_leaderboard')("test0")
+    await call('get_test_stats')("test0")
+    await call('rebuild_test_stats')(chunk_size=2)
+
+    async for _ in call('iter_subscribed_users')(chunk_size=1):
+        pass
+    async for _ in call('iter_slot_users')(1, chunk_size=1):
+        pass
+    await call('unsubscribe_users')([friend_id])
+
+    job_id = await call('create_broadcast_job')("hello")
+    await call('get_unfinished_broadcast_job')()
+    await call('checkpoint_broadcast_job')(job_id, friend_id, 1, 0, 0)
+    await call('finish_broadcast_job')(job_id)
+    await call('get_broadcast_job')(job_id)
+    await call('get_last_broadcast_age')()
+
+    await call('acquire_lease')("broadcast", "replica-1", 10)
+    await call('release_lease')("broadcast", "replica-1")
+
+    await call('save_fsm_record')("key", "Form:name", "{}", time.time())
+    await call('get_fsm_record')("key")
+    await call('delete_fsm_record')("key")
+    await call('purge_fsm_records')(time.time())
+    return called
+
+
+def test_queries_do_not_scan_tables(tmp_path):
+    path = str(tmp_path / "plans.db")
+    statements = []
+
+    async def run():
+        db = Database(path)
+        await db.init_db()
+        await db.pool.set_trace_callback(statements.append)
+        called = await exercise(db)
+        await db.pool.set_trace_callback(None)
+        await db.close()
+        return called
+    called = asyncio.run(run())
+
+    public = {
+        name for name, member in vars(Database).items()
+        if not name.startswith("_") and name not in NOT_QUERIES
+        and (inspect.iscoroutinefunction(member) or inspect.isasyncgenfunction(member))
+    }
+    # Новый метод Database нужно добавить в exercise, иначе его запросы не проверяются
+    assert public <= called, f"Not exercised: {sorted(public - called)}"
+
+    queries = {sql.strip() for sql in statements if sql.lstrip().upper().startswith(DATA_STATEMENTS)}
+    assert queries
+
+    conn = sqlite3.connect(path)
+    try:
+        scans = []
+        for sql in sorted(queries):
+            for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+                detail = row[3]
+                if detail.startswith("SCAN") and not detail.startswith(ALLOWED_SCANS):
+                    scans.append(f"{detail}: {' '.join(sql.split())}")
+    finally:
+        conn.close()
+    assert not scans, "\n".join(scans)
@@ -0,0 +1,101 @@
+"""
+Запись обновлений: порядок мидлварей и обезличивание
+"""
+import asyncio
+import json
+
+from aiogram import Dispatcher
+from aiogram.types import Message, Update
+
+import config
+from fakebot import make_fake_bot
+from recorder import Anonymizer, UpdateRecorder, setup_recorder
+from throttling import ThrottlingMiddleware, setup_throttling
+from webhook_harness import load_updates
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Аня"},
+            "text": text,
+        },
+    })
+
+
+def test_throttled_updates_are_recorded(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "THROTTLE_RATE", 1.0)
+    monkeypatch.setattr(config, "THROTTLE_BURST", 3)
+    path = tmp_path / "updates.jsonl"
+
+    dp = Dispatcher()
+    handled = []
+
+    @dp.message()
+    async def on_message(message: Message):
+        handled.append(message.text)
+
+    # Тот же порядок, что в bot.py: ограничение частоты подключается раньше записи
+    throttling = setup_throttling(dp)
+    recorder = setup_recorder(dp, str(path))
+    order = [type(middleware) for middleware in dp.update.outer_middleware]
+    assert order.index(UpdateRecorder) < order.index(ThrottlingMiddleware)
+
+    async def feed():
+        bot = make_fake_bot()
+        for update_id in range(10):
+            await dp.feed_update(bot, make_update(update_id, 5, "/start"))
+    asyncio.run(feed())
+    recorder.close()
+
+    assert len(handled) == 3
+    assert throttling.stats()['throttled'] == 7
+    records = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [record["u"]["update_id"] for record in records] == list(range(10))
+
+
+def test_anonymizer_keeps_only_known_texts():
+    anonymizer = Anonymizer("salt")
+    assert anonymizer.text("/start") == "/start"
+    assert anonymizer.text("/start test_0123456789ab") == "/start test_0123456789ab"
+    assert anonymizer.text("Карие") == "Карие"
+    assert anonymizer.text("/note call me at +7 999 123 45 67").startswith("text_")
+    assert anonymizer.text("/start +7 999 123 45 67").startswith("text_")
+    # Один и тот же текст - один и тот же токен (имена сравниваются без учёта регистра)
+    assert anonymizer.text("Аня") == anonymizer.text("аня ")
+
+
+def test_anonymizer_replaces_file_ids():
+    anonymizer = Anonymizer("salt")
+    raw = make_update(1, 5, "x").model_dump(mode="json", exclude_none=True, by_alias=True)
+    del raw["message"]["text"]
+    raw["message"]["voice"] = {"file_id": "AwACAgIAAxkBAAI", "file_unique_id": "AgADxx", "duration": 3}
+    raw["message"]["photo"] = [{"file_id": "AgACAgIAAxkBAAI", "file_unique_id": "AQADyy",
+                                "width": 90, "height": 90}]
+
+    record = json.dumps(anonymizer.anonymize(raw), ensure_ascii=False)
+    for value in ("AwACAgIAAxkBAAI", "AgADxx", "AgACAgIAAxkBAAI", "AQADyy", "Аня"):
+        assert value not in record
+    # Запись остаётся корректным обновлением для replay.py
+    Update.model_validate(json.loads(record))
+
+
+def test_webhook_harness_reads_recorder_files(tmp_path):
+    path = tmp_path / "updates.jsonl"
+    updates = [
+        make_update(update_id, 5, "/start").model_dump(mode="json", exclude_none=True, by_alias=True)
+        for update_id in range(3)
+    ]
+    # Например, склеенные записи воркеров: порядок восстанавливается по времени получения
+    records = [{"t": 12.5, "u": updates[1]}, {"t": 10.0, "u": updates[0]}, {"t": 13.0, "u": updates[2]}]
+    path.write_text("".join(json.dumps(record) + "\n" for record in records), encoding="utf-8")
+
+    assert load_updates(str(path)) == updates
+
+    # Файл с обновлениями без обёртки читается как есть
+    path.write_text("".join(json.dumps(update) + "\n" for update in updates), encoding="utf-8")
+    assert load_updates(str(path)) == updates
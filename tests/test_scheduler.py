@@ -0,0 +1,91 @@
+"""
+Аренда лидерства рассылки: освобождение аренды посреди рассылки
+"""
+import asyncio
+
+import config
+from database import Database
+from fakebot import make_fake_bot
+from scheduler import BROADCAST_LEASE, BroadcastScheduler
+
+
+def test_release_leadership_stops_broadcast_before_releasing_lease(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "broadcast.db"))
+        await db.init_db()
+        try:
+            for user_id in range(1, 201):
+                await db.add_user(user_id)
+            bot = make_fake_bot(latency=0.01)
+            scheduler = BroadcastScheduler(bot, db)
+            await scheduler.heartbeat()
+            assert scheduler.is_leader
+
+            broadcast = asyncio.create_task(scheduler.broadcast_message())
+            await asyncio.sleep(0.2)
+            await scheduler.release_leadership()
+            sent = len(bot.session.calls)
+
+            # Рассылка остановлена, прогресс сохранён, аренда свободна для другой реплики
+            assert broadcast.done()
+            await asyncio.sleep(0.05)
+            assert len(bot.session.calls) == sent
+            job = await db.get_unfinished_broadcast_job()
+            assert 0 < job['sent'] <= sent
+            assert job['cursor_user_id'] > 0
+            assert await db.acquire_lease(BROADCAST_LEASE, "other-replica", config.LEADER_LEASE_TTL)
+        finally:
+            await db.close()
+    asyncio.run(run())
+
+
+def test_new_leader_skips_broadcast_within_the_same_period(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "broadcast.db"))
+        await db.init_db()
+        try:
+            await db.add_user(1)
+            bot = make_fake_bot()
+            first = BroadcastScheduler(bot, db)
+            await first.heartbeat()
+            await first.broadcast_message()
+            await first.release_leadership()
+            sent = len(bot.session.calls)
+            assert sent == 1
+
+            # Аренду подхватывает другая реплика, её таймер срабатывает раньше конца периода
+            second = BroadcastScheduler(bot, db)
+            await second.heartbeat()
+            await second.broadcast_message()
+            assert len(bot.session.calls) == sent
+            await second.release_leadership()
+        finally:
+            await db.close()
+    asyncio.run(run())
+
+
+def test_interrupted_job_resumes_after_checkpoint_cursor(tmp_path):
+    async def run():
+        db = Database(str(tmp_path / "broadcast.db"))
+        await db.init_db()
+        try:
+            for user_id in range(1, 11):
+                await db.add_user(user_id)
+            # Прошлый лидер успел обработать пользователей до 5-го включительно
+            job_id = await db.create_broadcast_job("text", mode='burst')
+            await db.checkpoint_broadcast_job(job_id, 5, sent=4, failed=1, unreachable=0)
+
+            bot = make_fake_bot()
+            scheduler = BroadcastScheduler(bot, db)
+            # Став лидером, реплика сама продолжает прерванное задание
+            await scheduler.heartbeat()
+            await scheduler._resume_task
+            await scheduler.release_leadership()
+
+            assert [call.chat_id for call in bot.session.calls] == [6, 7, 8, 9, 10]
+            job = await db.get_broadcast_job(job_id)
+            assert job['status'] == 'done'
+            assert (job['cursor_user_id'], job['sent'], job['failed']) == (10, 9, 1)
+        finally:
+            await db.close()
+    asyncio.run(run())
@@ -0,0 +1,131 @@
+"""
+Коды ответов: упаковка, подсчёт результата и перенос старых ответов миграцией
+"""
+import asyncio
+import itertools
+import sqlite3
+
+import pytest
+
+from database import Database
+from scoring import (
+    CHOICE_FIELDS, OPTION_CODES, TOTAL_QUESTIONS, pack_answers, score_answer,
+    score_batch, unpack_answers
+)
+
+# Все сочетания ответов, включая отсутствующие
+ALL_ANSWERS = [
+    dict(zip(CHOICE_FIELDS, values))
+    for values in itertools.product(*([None, *OPTION_CODES[field]] for field in CHOICE_FIELDS))
+]
+
+# Схема базы до версионных миграций
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    is_subscribed INTEGER DEFAULT 1
+);
+CREATE TABLE tests (
+    test_id TEXT PRIMARY KEY,
+    creator_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    height_range TEXT,
+    eye_color TEXT,
+    fear TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (creator_id) REFERENCES users(user_id)
+);
+CREATE TABLE test_answers (
+    answer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    test_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    name TEXT,
+    height_range TEXT,
+    eye_color TEXT,
+    fear TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (test_id) REFERENCES tests(test_id),
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+"""
+
+
+def test_codes_are_fixed():
+    # Коды уже лежат в базе: перестановка вариантов на клавиатуре их не меняет
+    assert pack_answers({'height_range': "140-159", 'eye_color': "Карие", 'fear': "Высоты"}) == 0o111
+    assert pack_answers({'height_range': "200+", 'eye_color': "Серые", 'fear': "Одиночества"}) == 0o444
+    assert pack_answers({'eye_color': "Зелёные"}) == 0o030
+
+
+def test_pack_unpack_round_trip():
+    for answer in ALL_ANSWERS:
+        assert unpack_answers(pack_answers(answer)) == answer
+
+
+def test_unknown_answer_is_rejected():
+    with pytest.raises(ValueError):
+        pack_answers({'height_range': "250+", 'eye_color': "Карие", 'fear': "Высоты"})
+
+
+def test_score_batch_matches_score_answer():
+    for test_answers in ALL_ANSWERS[::7]:
+        test = {**test_answers, 'name': "Маша"}
+        names = [("маша", "Петя", None)[index % 3] for index in range(len(ALL_ANSWERS))]
+        expected = [
+            score_answer(test, {**answer, 'name': name})
+            for answer, name in zip(ALL_ANSWERS, names)
+        ]
+        packed = [pack_answers(answer) for answer in ALL_ANSWERS]
+        assert score_batch(test, packed, names) == expected
+        assert score_batch({**test, 'answers_packed': pack_answers(test)}, packed, names) == expected
+
+
+def test_migration_packs_baseline_answers(tmp_path):
+    path = str(tmp_path / "baseline.db")
+    test_row = ("test_000000000001", 1, "Маша", "160-179", "Зелёные", "Пауков")
+    answer_rows = [
+        ("test_000000000001", 2, "маша", "160-179", "Зелёные", "Пауков"),
+        ("test_000000000001", 3, "Петя", "160-179", "Карие", "Пауков"),
+        ("test_000000000001", 4, "Вася", "200+", "Серые", "Высоты"),
+    ]
+    with sqlite3.connect(path) as connection:
+        connection.executescript(BASELINE_SCHEMA)
+        connection.executemany("INSERT INTO users (user_id) VALUES (?)", [(1,), (2,), (3,), (4,)])
+        connection.execute("""
+            INSERT INTO tests (test_id, creator_id, name, height_range, eye_color, fear)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, test_row)
+        connection.executemany("""
+            INSERT INTO test_answers (test_id, user_id, name, height_range, eye_color, fear)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, answer_rows)
+
+    async def run():
+        db = Database(path)
+        await db.init_db()
+        try:
+            test = await db.get_test("test_000000000001")
+            stats = await db.get_test_stats("test_000000000001")
+        finally:
+            await db.close()
+        return test, stats
+
+    test, stats = asyncio.run(run())
+
+    assert (test['height_range'], test['eye_color'], test['fear']) == test_row[3:]
+    assert test['answers_packed'] == pack_answers(test)
+    assert stats['completions'] == len(answer_rows)
+
+    with sqlite3.connect(path) as connection:
+        rows = connection.execute("""
+            SELECT user_id, name, answers_packed, matches, percentage
+            FROM test_answers ORDER BY answer_id
+        """).fetchall()
+    assert [(row[0], row[3]) for row in rows] == [(2, TOTAL_QUESTIONS), (3, 2), (4, 0)]
+    for (_, _, _, *choices), (_, name, packed, matches, percentage) in zip(answer_rows, rows):
+        assert unpack_answers(packed) == dict(zip(CHOICE_FIELDS, choices))
+        score = score_answer(test, {'name': name, 'answers_packed': packed})
+        assert (score.matches, score.percentage) == (matches, percentage)
@@ -0,0 +1,100 @@
+"""
+Хранилище FSM: лишние записи и согласованность кэша между процессами
+"""
+import asyncio
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+
+import config
+from database import Database
+from flows import clear_state, set_state_and_data
+from states import CreateTestStates
+from storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=42, chat_id=5, user_id=5)
+
+
+def run_with_storages(tmp_path, scenario, storages=1, cache_ttl=3600.0, writes=None,
+                      write_behind=False):
+    """
+    Сценарий с несколькими хранилищами над одной базой (как у нескольких процессов),
+    возвращает выполненные запросы к fsm_states
+    """
+    writes = [] if writes is None else writes
+
+    async def run():
+        db = Database(str(tmp_path / "fsm.db"))
+        config.WRITE_BEHIND_ENABLED = write_behind
+        try:
+            await db.init_db()
+        finally:
+            config.WRITE_BEHIND_ENABLED = False
+        await db.pool.set_trace_callback(
+            lambda sql: writes.append(sql) if "fsm_states" in sql else None
+        )
+        try:
+            await scenario(*[SQLiteStorage(db, cache_ttl=cache_ttl) for _ in range(storages)])
+        finally:
+            await db.close()
+    asyncio.run(run())
+    return writes
+
+
+def test_clearing_empty_state_does_not_write(tmp_path):
+    async def scenario(storage):
+        for _ in range(2):
+            # Как FSMContextMiddleware: состояние читается перед обработчиком
+            await storage.get_state(KEY)
+            await clear_state(FSMContext(storage, KEY))
+
+    queries = run_with_storages(tmp_path, scenario)
+    assert [sql.split()[0] for sql in queries] == ["SELECT"]
+
+
+def test_dialog_steps_read_storage_once(tmp_path):
+    async def scenario(storage):
+        state = FSMContext(storage, KEY)
+        await state.get_state()
+        for step in CreateTestStates.__all_states__:
+            await state.get_state()
+            data = await state.get_data()
+            await set_state_and_data(state, step, {**data, step.state: "ответ"})
+        await clear_state(state)
+
+    queries = run_with_storages(tmp_path, scenario)
+    assert [sql.split()[0] for sql in queries if sql.lstrip().startswith("SELECT")] == ["SELECT"]
+
+
+def test_finishing_dialog_is_one_delete(tmp_path):
+    writes = []
+
+    async def scenario(storage):
+        state = FSMContext(storage, KEY)
+        await set_state_and_data(state, CreateTestStates.waiting_for_name, {'name': "Аня"})
+        writes.clear()
+        await clear_state(state)
+        assert await state.get_state() is None
+
+    run_with_storages(tmp_path, scenario, writes=writes)
+    assert [sql.split()[0] for sql in writes if not sql.lstrip().startswith("SELECT")] == ["DELETE"]
+
+
+def test_cache_ttl_rereads_state_written_elsewhere(tmp_path):
+    async def scenario(first, second):
+        assert await first.get_state(KEY) is None
+        await second.set_state(KEY, CreateTestStates.waiting_for_name)
+        assert await first.get_state(KEY) == CreateTestStates.waiting_for_name.state
+
+    run_with_storages(tmp_path, scenario, storages=2, cache_ttl=0)
+
+
+def test_state_is_readable_right_after_write_behind_save(tmp_path):
+    async def scenario(first, second):
+        # Очередь без ожидания коммита (WRITE_BEHIND_DURABLE=0)
+        first.db.write_queue.durable = False
+        await first.set_state(KEY, CreateTestStates.waiting_for_name)
+        # Без кэша чтение идёт в базу: запись должна быть уже закоммичена
+        assert await second.get_state(KEY) == CreateTestStates.waiting_for_name.state
+
+    run_with_storages(tmp_path, scenario, storages=2, cache_ttl=0, write_behind=True)
@@ -0,0 +1,128 @@
+"""
+Отложенная запись: групповые коммиты, обратное давление и запись при остановке
+"""
+import asyncio
+import sqlite3
+
+import config
+from database import Database, WriteBehindQueue
+
+
+def insert_user(user_id: int):
+    return [("INSERT INTO users (user_id) VALUES (?)", (user_id,))]
+
+
+def saved_users(db: Database):
+    with sqlite3.connect(db.db_path) as connection:
+        return [row[0] for row in connection.execute("SELECT user_id FROM users ORDER BY user_id")]
+
+
+def run_with_queue(tmp_path, scenario, start=True, **options):
+    """Сценарий с очередью отложенной записи над новой базой"""
+    async def run():
+        db = Database(str(tmp_path / "write_behind.db"))
+        await db.init_db()
+        queue = WriteBehindQueue(db, **options)
+        if start:
+            queue.start()
+        try:
+            await scenario(db, queue)
+        finally:
+            await queue.close()
+            await db.close()
+    asyncio.run(run())
+
+
+def test_batch_is_written_when_full(tmp_path):
+    async def scenario(db, queue):
+        for user_id in (1, 2, 3, 4):
+            await queue.submit(insert_user(user_id))
+        await asyncio.sleep(0.05)
+        # Полная пачка записана сразу, неполная ждёт max_delay_ms
+        assert (queue.batches, queue.written) == (1, 3)
+        assert saved_users(db) == [1, 2, 3]
+        await queue.close()
+        assert (queue.batches, queue.written) == (2, 4)
+        assert saved_users(db) == [1, 2, 3, 4]
+
+    run_with_queue(tmp_path, scenario, max_batch=3, max_delay_ms=60_000, durable=False)
+
+
+def test_batch_is_written_after_delay(tmp_path):
+    async def scenario(db, queue):
+        await queue.submit(insert_user(1))
+        await queue.submit(insert_user(2))
+        assert saved_users(db) == []
+        await asyncio.sleep(0.2)
+        assert (queue.batches, queue.written) == (1, 2)
+        assert saved_users(db) == [1, 2]
+
+    run_with_queue(tmp_path, scenario, max_batch=100, max_delay_ms=20, durable=False)
+
+
+def test_submit_waits_when_queue_is_full(tmp_path):
+    async def scenario(db, queue):
+        await queue.submit(insert_user(1))
+        await queue.submit(insert_user(2))
+        blocked = asyncio.create_task(queue.submit(insert_user(3)))
+        await asyncio.sleep(0.05)
+        assert not blocked.done()
+
+        queue.start()
+        await asyncio.wait_for(blocked, 1)
+        await queue.close()
+        assert saved_users(db) == [1, 2, 3]
+
+    run_with_queue(tmp_path, scenario, start=False, max_pending=2, durable=False)
+
+
+def test_durable_submit_returns_after_commit(tmp_path):
+    async def scenario(db, queue):
+        await queue.submit(insert_user(1))
+        assert saved_users(db) == [1]
+
+    run_with_queue(tmp_path, scenario, max_delay_ms=50, durable=True)
+
+
+def test_non_durable_submit_waits_only_when_asked(tmp_path):
+    async def scenario(db, queue):
+        await queue.submit(insert_user(1))
+        assert saved_users(db) == []
+        await queue.submit(insert_user(2), wait=True)
+        assert saved_users(db) == [1, 2]
+
+    run_with_queue(tmp_path, scenario, max_delay_ms=50, durable=False)
+
+
+def test_failed_batch_is_retried_one_by_one(tmp_path):
+    async def scenario(db, queue):
+        results = await asyncio.gather(
+            queue.submit(insert_user(1)),
+            queue.submit([("INSERT INTO missing_table (user_id) VALUES (?)", (2,))]),
+            queue.submit(insert_user(3)),
+            return_exceptions=True,
+        )
+        assert results[0] is None and results[2] is None
+        assert isinstance(results[1], sqlite3.OperationalError)
+        assert saved_users(db) == [1, 3]
+        assert (queue.batches, queue.written, queue.lost) == (0, 2, 1)
+
+    run_with_queue(tmp_path, scenario, max_delay_ms=50, durable=True)
+
+
+def test_database_close_drains_queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'WRITE_BEHIND_ENABLED', True)
+
+    async def run():
+        db = Database(str(tmp_path / "write_behind.db"))
+        await db.init_db()
+        db.write_queue.durable = False
+        db.write_queue.max_delay = 60
+        for user_id in (1, 2, 3):
+            await db.add_user(user_id)
+        assert saved_users(db) == []
+        await db.close()
+        assert db.write_queue is None
+        return saved_users(db)
+
+    assert asyncio.run(run()) == [1, 2, 3]
@@ -0,0 +1,156 @@
+"""
+Ограничение частоты входящих обновлений от одного пользователя. Лишние обновления
+отбрасываются до хранилища состояний и роутеров, поэтому флуд одного клиента
+не нагружает базу и не увеличивает задержку остальным.
+"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import TelegramObject, Update
+
+import config
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class ThrottleTable:
+    """
+    Вёдра токенов пользователей: не больше max_size записей (вытесняются давно
+    не писавшие), ведро, простоявшее дольше ttl, удаляется
+    """
+
+    def __init__(self, rate: float, burst: float, max_size: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_size = max_size
+        # За burst / rate секунд простоя ведро наполняется целиком -
+        # удалить его после этого всё равно что оставить
+        self.ttl = burst / rate
+        self._buckets: OrderedDict = OrderedDict()
+        # Пользователи, которым уже ответили о превышении лимита в текущей серии
+        self._warned: Set[int] = set()
+        self.evictions = 0
+        self.expired = 0
+
+    def _remove_oldest(self):
+        user_id, _ = self._buckets.popitem(last=False)
+        self._warned.discard(user_id)
+
+    def _expire(self, now: float):
+        """Удаление простаивающих вёдер: они упорядочены по последнему обращению"""
+        while self._buckets:
+            bucket = next(iter(self._buckets.values()))
+            if now - bucket.updated < self.ttl:
+                break
+            self._remove_oldest()
+            self.expired += 1
+
+    def allow(self, user_id: int) -> bool:
+        """Списание токена пользователя, False если лимит исчерпан"""
+        self._expire(time.monotonic())
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+            while len(self._buckets) > self.max_size:
+                self._remove_oldest()
+                self.evictions += 1
+        else:
+            self._buckets.move_to_end(user_id)
+
+        if bucket.try_consume():
+            self._warned.discard(user_id)
+            return True
+        return False
+
+    def should_warn(self, user_id: int) -> bool:
+        """Нужно ли ответить пользователю: только на первое отброшенное обновление серии"""
+        if user_id in self._warned:
+            return False
+        self._warned.add(user_id)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Внешняя мидлварь обновлений: обновления сверх лимита пользователя не обрабатываются.
+    Серия отброшенных обновлений схлопывается в один ответ пользователю
+    """
+
+    def __init__(self, rate: float = config.THROTTLE_RATE, burst: float = config.THROTTLE_BURST,
+                 max_size: int = config.THROTTLE_TABLE_SIZE):
+        self.table = ThrottleTable(rate, burst, max_size)
+        self.passed = 0
+        self.warned = 0
+        # Отброшенные обновления по типам (message, callback_query, ...)
+        self.throttled: Dict[str, int] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or self.table.allow(user.id):
+            self.passed += 1
+            return await handler(event, data)
+
+        update_type = event.event_type
+        self.throttled[update_type] = self.throttled.get(update_type, 0) + 1
+        if self.table.should_warn(user.id):
+            self.warned += 1
+            await self._warn(event)
+        return UNHANDLED
+
+    async def _warn(self, event: Update):
+        try:
+            if event.message is not None:
+                await event.message.answer(config.THROTTLE_MESSAGE)
+            elif event.callback_query is not None:
+                await event.callback_query.answer(config.THROTTLE_MESSAGE)
+        except TelegramAPIError as e:
+            logger.warning(f"Error sending throttle warning: {e}")
+
+    def stats(self) -> Dict:
+        """Число пропущенных и отброшенных обновлений и размер таблицы пользователей"""
+        return {
+            'users': len(self.table),
+            'max_users': self.table.max_size,
+            'passed': self.passed,
+            'throttled': sum(self.throttled.values()),
+            'throttled_by_type': dict(self.throttled),
+            'warned': self.warned,
+            'evictions': self.table.evictions,
+            'expired': self.table.expired,
+        }
+
+
+def setup_throttling(dp: Dispatcher) -> Optional[ThrottlingMiddleware]:
+    """
+    Подключение ограничения частоты к диспетчеру (None, если THROTTLE_RATE = 0).
+    Мидлварь встаёт перед FSMContextMiddleware, которая читает состояние из хранилища,
+    но после UserContextMiddleware, которая определяет пользователя
+    """
+    if config.THROTTLE_RATE <= 0:
+        return None
+    middleware = ThrottlingMiddleware(
+        config.THROTTLE_RATE, config.THROTTLE_BURST, config.THROTTLE_TABLE_SIZE
+    )
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(middleware)
+    dp.update.outer_middleware(dp.fsm)
+    dp["throttling"] = middleware
+
+    async def log_stats():
+        logger.info(f"Throttling stats: {middleware.stats()}")
+    dp.shutdown.register(log_stats)
+    return middleware
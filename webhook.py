@@ -0,0 +1,203 @@
+"""
+Приём обновлений через вебхук - альтернатива long polling
+"""
+import asyncio
+import hmac
+import logging
+from typing import Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.types.update import UpdateTypeLookupError
+from aiohttp import web
+
+import config
+from metrics import REGISTRY, stats_samples
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_user_id(update: Update) -> Optional[int]:
+    """Пользователь, от которого пришло обновление (None, если его нет)"""
+    try:
+        event = update.event
+    except UpdateTypeLookupError:
+        return None
+    user = getattr(event, 'from_user', None)
+    return user.id if user else None
+
+
+def check_secret_token(request: web.Request, secret_token: str) -> bool:
+    """Проверка секрета вебхука (сравнение за постоянное время - секрет не подобрать по таймингам)"""
+    received_token = request.headers.get(SECRET_TOKEN_HEADER, "")
+    return hmac.compare_digest(received_token.encode(), secret_token.encode())
+
+
+class OrderedUpdateProcessor:
+    """
+    Фоновая обработка обновлений: одновременно не больше max_concurrent, обновления
+    одного пользователя - строго по очереди (иначе ответы анкеты могут обогнать друг друга)
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher,
+                 max_concurrent: int = config.WEBHOOK_MAX_CONCURRENT_UPDATES):
+        self.bot = bot
+        self.dp = dp
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._tasks: Set[asyncio.Task] = set()
+        # Последняя задача каждого пользователя - следующая ждёт её завершения
+        self._last_task: Dict[Optional[int], asyncio.Task] = {}
+        # Метрики
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.processing_time_total = 0.0
+
+    @property
+    def pending(self) -> int:
+        """Сколько принятых обновлений ещё не обработано"""
+        return len(self._tasks)
+
+    def submit(self, update: Update):
+        """Постановка обновления в обработку"""
+        self.received += 1
+        user_id = update_user_id(update)
+        task = asyncio.create_task(self._process(update, self._last_task.get(user_id)))
+        self._tasks.add(task)
+        if user_id is not None:
+            self._last_task[user_id] = task
+        task.add_done_callback(lambda done: self._forget(done, user_id))
+
+    def _forget(self, task: asyncio.Task, user_id: Optional[int]):
+        self._tasks.discard(task)
+        if self._last_task.get(user_id) is task:
+            del self._last_task[user_id]
+
+    async def _process(self, update: Update, previous: Optional[asyncio.Task]):
+        """Обработка обновления после предыдущего обновления того же пользователя"""
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with self._semaphore:
+            started = asyncio.get_running_loop().time()
+            try:
+                await self.dp.feed_update(self.bot, update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error processing update {update.update_id}: {e}", exc_info=True)
+            finally:
+                self.processing_time_total += asyncio.get_running_loop().time() - started
+
+    async def wait_for_capacity(self, max_pending: int):
+        """Ожидание, пока необработанных обновлений станет меньше max_pending"""
+        while len(self._tasks) >= max_pending:
+            await asyncio.wait(list(self._tasks), return_when=asyncio.FIRST_COMPLETED)
+
+    async def wait_closed(self):
+        """Ожидание обработки всех принятых обновлений"""
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    def stats(self) -> Dict:
+        """Счётчики принятых и обработанных обновлений"""
+        finished = self.processed + self.failed
+        return {
+            'received': self.received,
+            'processed': self.processed,
+            'failed': self.failed,
+            'pending': self.pending,
+            'processing_time_avg_ms': (
+                self.processing_time_total / finished * 1000 if finished else 0.0
+            ),
+        }
+
+
+class WebhookServer:
+    """
+    HTTP-приёмник обновлений Telegram. Telegram сразу получает ответ 200, а обновление
+    обрабатывается в фоне через OrderedUpdateProcessor. Если необработанных обновлений
+    уже max_pending, новые отклоняются с 503 - Telegram повторит их доставку позже.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, secret_token: str,
+                 path: str = config.WEBHOOK_PATH,
+                 max_concurrent: int = config.WEBHOOK_MAX_CONCURRENT_UPDATES,
+                 max_pending: int = config.WEBHOOK_MAX_PENDING_UPDATES):
+        self.bot = bot
+        self.secret_token = secret_token
+        self.path = path
+        self.max_pending = max_pending
+        self.processor = OrderedUpdateProcessor(bot, dp, max_concurrent)
+        self.rejected = 0
+        self.unauthorized = 0
+
+    def make_app(self) -> web.Application:
+        """Приложение aiohttp с маршрутом вебхука"""
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Приём одного обновления"""
+        if not check_secret_token(request, self.secret_token):
+            self.unauthorized += 1
+            return web.Response(status=401)
+
+        if self.processor.pending >= self.max_pending:
+            self.rejected += 1
+            return web.Response(status=503)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError:
+            return web.Response(status=400)
+
+        self.processor.submit(update)
+        return web.Response()
+
+    async def wait_closed(self):
+        """Ожидание обработки всех принятых обновлений"""
+        await self.processor.wait_closed()
+
+    def stats(self) -> Dict:
+        """Счётчики принятых, обработанных и отклонённых обновлений"""
+        return {
+            **self.processor.stats(),
+            'rejected': self.rejected,
+            'unauthorized': self.unauthorized,
+        }
+
+
+async def start_webhook_site(app: web.Application, bot: Bot, allowed_updates) -> web.AppRunner:
+    """Запуск HTTP-сервера и регистрация вебхука в Telegram"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Webhook server listening on {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}")
+
+    # Регистрация повторяется каждой репликой - Telegram просто перезаписывает адрес
+    await bot.set_webhook(
+        url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+        secret_token=config.WEBHOOK_SECRET,
+        allowed_updates=allowed_updates,
+    )
+    return runner
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Запуск сервера вебхука и регистрация вебхука в Telegram (до отмены задачи)"""
+    server = WebhookServer(bot, dp, config.WEBHOOK_SECRET)
+    REGISTRY.add_collector("webhook", lambda: stats_samples("bot_webhook", server.stats()))
+    runner = await start_webhook_site(server.make_app(), bot, dp.resolve_used_update_types())
+    await dp.emit_startup(bot=bot, **dp.workflow_data)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        # Сначала перестаём принимать обновления, затем дорабатываем принятые
+        await runner.cleanup()
+        await server.wait_closed()
+        logger.info(f"Webhook stats: {server.stats()}")
+        await dp.emit_shutdown(bot=bot, **dp.workflow_data)
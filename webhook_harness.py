@@ -0,0 +1,210 @@
+"""
+Локальная проверка режима вебхука: записанные обновления (JSONL, по одному
+объекту Update в строке, или запись recorder.py) отправляются POST-запросами на сервер вебхука.
+
+    # поднять сервер в процессе (фейковый бот, временная база) и прогнать 50 диалогов
+    python webhook_harness.py --serve --generate 50
+
+    # отправить записанные обновления на уже запущенного бота
+    python webhook_harness.py updates.jsonl --url http://127.0.0.1:8080/webhook --secret SECRET
+
+Обновления одного пользователя отправляются по очереди, разных пользователей - параллельно.
+На 503 (сервер перегружен) обновление отправляется повторно, как это делает Telegram.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import aiohttp
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Перцентиль q (0-100) по ближайшему рангу"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def generate_updates(users: int, first_user_id: int = 1_000_000) -> List[Dict]:
+    """Типовые диалоги: регистрация, создание теста и просмотр своих тестов"""
+    answers = ["/start", "Создать тест", "Тестовый", "160-179", "Карие", "Пауков", "Мой тест"]
+    update_ids = itertools.count(1)
+    updates = []
+    for user_id in range(first_user_id, first_user_id + users):
+        for text in answers:
+            update_id = next(update_ids)
+            updates.append({
+                "update_id": update_id,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+                    "text": text,
+                },
+            })
+    return updates
+
+
+def load_updates(path: str) -> List[Dict]:
+    """
+    Чтение записанных обновлений: объекты Update или записи recorder.py
+    ({"t": время получения, "u": обновление}) - их порядок восстанавливается по "t"
+    """
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "u" in record and "update_id" not in record:
+                records.append((record.get("t", 0.0), index, record["u"]))
+            else:
+                records.append((0.0, index, record))
+    records.sort(key=lambda record: record[:2])
+    return [update for _, _, update in records]
+
+
+def _update_user_id(update: Dict) -> Optional[int]:
+    for key, event in update.items():
+        if isinstance(event, dict) and "from" in event:
+            return event["from"]["id"]
+    return None
+
+
+async def post_updates(url: str, secret: str, updates: Iterable[Dict],
+                       concurrency: int = 50, max_retries: int = 20) -> Dict:
+    """Отправка обновлений на вебхук, возвращает коды ответов и задержку приёма"""
+    by_user = defaultdict(list)
+    for update in updates:
+        by_user[_update_user_id(update)].append(update)
+
+    statuses = Counter()
+    retries = 0
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret}
+
+    async def send_user_updates(session: aiohttp.ClientSession, user_updates: List[Dict]):
+        nonlocal retries
+        for update in user_updates:
+            for attempt in range(max_retries + 1):
+                async with semaphore:
+                    started = time.perf_counter()
+                    async with session.post(url, json=update, headers=headers) as response:
+                        status = response.status
+                    latencies.append(time.perf_counter() - started)
+                if status != 503 or attempt == max_retries:
+                    break
+                retries += 1
+                await asyncio.sleep(0.05 * (attempt + 1))
+            statuses[status] += 1
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(
+            send_user_updates(session, user_updates) for user_updates in by_user.values()
+        ))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "updates": sum(statuses.values()),
+        "requests": len(latencies),
+        "retries": retries,
+        "elapsed_seconds": round(elapsed, 3),
+        "updates_per_second": round(sum(statuses.values()) / elapsed, 1) if elapsed else 0.0,
+        "statuses": dict(statuses),
+        "ack_latency_ms": {
+            f"p{q}": round(percentile(latencies, q) * 1000, 2) for q in (50, 95, 99)
+        },
+    }
+
+
+async def run_local(updates: List[Dict], concurrency: int, port: int) -> Dict:
+    """Прогон через сервер вебхука в этом же процессе: фейковый бот и временная база"""
+    workdir = tempfile.mkdtemp(prefix="webhook_harness_")
+    # Путь к базе нужно подменить до импорта database: путь по умолчанию читается при импорте
+    config.DATABASE_PATH = os.path.join(workdir, "harness.db")
+    # Обновления пользователя отправляются без пауз и упёрлись бы в ограничение частоты
+    config.THROTTLE_RATE = 0
+    from aiohttp import web
+    from bot import build_dispatcher, warm_up
+    from database import Database
+    from fakebot import make_fake_bot
+    from webhook import WebhookServer
+
+    db = Database()
+    await db.init_db()
+    bot = make_fake_bot()
+    dp = build_dispatcher(db)
+    await warm_up(bot, dp)
+    secret = "harness-secret"
+    server = WebhookServer(bot, dp, secret)
+    runner = web.AppRunner(server.make_app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    try:
+        url = f"http://127.0.0.1:{port}{server.path}"
+        result = await post_updates(url, secret, updates, concurrency)
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json=updates[0], headers={}) as response:
+                result["missing_secret_status"] = response.status
+        await server.wait_closed()
+        result["server"] = server.stats()
+        result["bot_calls"] = len(bot.session.calls)
+    finally:
+        await runner.cleanup()
+        await db.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отправка записанных обновлений на вебхук")
+    parser.add_argument("updates", nargs="?", help="JSONL-файл с обновлениями")
+    parser.add_argument("--generate", type=int, metavar="USERS",
+                        help="Сгенерировать типовые диалоги для USERS пользователей")
+    parser.add_argument("--save", help="Сохранить сгенерированные обновления в файл и выйти")
+    parser.add_argument("--serve", action="store_true",
+                        help="Поднять сервер вебхука в процессе (фейковый бот, временная база)")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=config.WEBHOOK_SECRET)
+    parser.add_argument("--port", type=int, default=8081, help="Порт сервера для --serve")
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.generate:
+        updates = generate_updates(args.generate)
+    elif args.updates:
+        updates = load_updates(args.updates)
+    else:
+        parser.error("Нужен файл с обновлениями или --generate")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            for update in updates:
+                f.write(json.dumps(update, ensure_ascii=False) + "\n")
+        return
+
+    if args.serve:
+        result = asyncio.run(run_local(updates, args.concurrency, args.port))
+    else:
+        result = asyncio.run(post_updates(args.url, args.secret, updates, args.concurrency))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
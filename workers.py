@@ -0,0 +1,293 @@
+"""
+Многопроцессный режим: родительский процесс принимает обновления (long polling или вебхук)
+и раскладывает их по процессам-воркерам по user_id, обработчики работают в воркерах.
+Все обновления одного пользователя попадают в один воркер - порядок шагов анкеты
+и кэш состояний FSM остаются согласованными.
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+from typing import Any, Dict, List, Optional, Sequence
+
+import aiohttp
+from aiogram import Bot
+from aiogram.enums import ParseMode
+from aiogram.types import Update
+from aiohttp import web
+
+import config
+from metrics import REGISTRY, setup_metrics, start_metrics_server, stats_samples
+
+logger = logging.getLogger(__name__)
+
+# Процессы запускаются "с нуля": у воркера свои соединения с базой и своя сессия бота
+_mp = multiprocessing.get_context("spawn")
+
+
+def raw_update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """Пользователь обновления по сырому JSON (без разбора в модели aiogram)"""
+    for event in update.values():
+        if isinstance(event, dict) and "from" in event:
+            return event["from"]["id"]
+    return None
+
+
+def shard_for(update: Dict[str, Any], workers: int) -> int:
+    """Номер воркера для обновления: по user_id, а без пользователя - по update_id"""
+    user_id = raw_update_user_id(update)
+    key = user_id if user_id is not None else update.get("update_id", 0)
+    return key % workers
+
+
+def outbound_share(workers: int) -> float:
+    """
+    Лимит отправки одного процесса в многопроцессном режиме: родитель (рассылка) и каждый
+    воркер (ответы пользователям) получают равные доли, вместе не больше общего лимита
+    """
+    return config.OUTBOUND_RATE_LIMIT / (workers + 1)
+
+
+def worker_main(shard: int, workers: int, updates: "multiprocessing.Queue",
+                stats: "multiprocessing.Queue", bot_username: str):
+    """Точка входа процесса-воркера"""
+    # Остановку воркеров координирует родитель (через сигнальное значение в очереди)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s - worker-{shard} - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(_run_worker(shard, workers, updates, stats, bot_username))
+
+
+async def _run_worker(shard: int, workers: int, updates: "multiprocessing.Queue",
+                      stats: "multiprocessing.Queue", bot_username: str):
+    from bot import build_dispatcher, warm_up
+    from database import Database
+    from outbound import OutboundLimiter, setup_outbound
+    from recorder import setup_recorder
+    from webhook import OrderedUpdateProcessor
+
+    db = Database()
+    await db.init_db()
+    bot = Bot(token=config.BOT_TOKEN, parse_mode=ParseMode.HTML)
+    limiter = setup_outbound(bot, OutboundLimiter(rate=outbound_share(workers)))
+    dp = build_dispatcher(db)
+    if config.RECORD_UPDATES_PATH:
+        setup_recorder(dp, f"{config.RECORD_UPDATES_PATH}.{shard}")
+    await warm_up(bot, dp, bot_username)
+    processor = OrderedUpdateProcessor(bot, dp, config.WORKER_MAX_CONCURRENT_UPDATES)
+    metrics_runner = None
+    if config.METRICS_PORT:
+        setup_metrics(bot, dp, db, limiter)
+        REGISTRY.add_collector(
+            "worker", lambda: stats_samples("bot_worker", processor.stats(), labels={'shard': str(shard)})
+        )
+        metrics_runner = await start_metrics_server(config.METRICS_PORT + 1 + shard)
+    await dp.emit_startup(bot=bot, **dp.workflow_data)
+
+    def report():
+        report = {'shard': shard, **processor.stats(), 'outbound': limiter.stats()}
+        if "throttling" in dp.workflow_data:
+            report['throttling'] = dp["throttling"].stats()
+        stats.put(report)
+
+    async def report_periodically():
+        while True:
+            await asyncio.sleep(config.WORKER_STATS_INTERVAL)
+            report()
+
+    reporter = asyncio.create_task(report_periodically())
+    loop = asyncio.get_running_loop()
+    logger.info(f"Worker {shard} started")
+    try:
+        while True:
+            await processor.wait_for_capacity(config.WORKER_MAX_PENDING_UPDATES)
+            raw_update = await loop.run_in_executor(None, updates.get)
+            if raw_update is None:
+                break
+            try:
+                update = Update.model_validate(raw_update, context={"bot": bot})
+            except ValueError as e:
+                logger.error(f"Invalid update skipped: {e}")
+                continue
+            processor.submit(update)
+    finally:
+        reporter.cancel()
+        await processor.wait_closed()
+        report()
+        await dp.emit_shutdown(bot=bot, **dp.workflow_data)
+        await db.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await bot.session.close()
+        logger.info(f"Worker {shard} stopped: {processor.stats()}")
+
+
+class ShardedRuntime:
+    """Процессы-воркеры, очереди обновлений к ним и метрики по шардам"""
+
+    def __init__(self, workers: int = config.BOT_WORKERS):
+        self.workers = workers
+        self.queues = [_mp.Queue(maxsize=config.WORKER_QUEUE_SIZE) for _ in range(workers)]
+        self.stats_queue = _mp.Queue()
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self.bot_username = ""
+        # Метрики по шардам: со стороны родителя и последний отчёт воркера
+        self.dispatched = [0] * workers
+        self.rejected = [0] * workers
+        self.restarts = [0] * workers
+        self.worker_stats: Dict[int, Dict] = {}
+
+    def start(self, bot_username: str):
+        """Запуск всех воркеров"""
+        self.bot_username = bot_username
+        for shard in range(self.workers):
+            self._spawn(shard)
+        logger.info(f"Started {self.workers} workers")
+
+    def _spawn(self, shard: int):
+        process = _mp.Process(
+            target=worker_main,
+            args=(shard, self.workers, self.queues[shard], self.stats_queue, self.bot_username),
+            name=f"bot-worker-{shard}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[shard] = process
+
+    def dispatch(self, update: Dict[str, Any]) -> bool:
+        """Передача обновления воркеру без ожидания, False если его очередь заполнена"""
+        shard = shard_for(update, self.workers)
+        try:
+            self.queues[shard].put_nowait(update)
+        except queue.Full:
+            self.rejected[shard] += 1
+            return False
+        self.dispatched[shard] += 1
+        return True
+
+    async def put(self, update: Dict[str, Any]):
+        """Передача обновления воркеру с ожиданием места в очереди"""
+        while not self.dispatch(update):
+            await asyncio.sleep(0.05)
+
+    def _collect_stats(self):
+        while True:
+            try:
+                report = self.stats_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.worker_stats[report['shard']] = report
+
+    async def monitor(self):
+        """Сбор метрик и перезапуск упавших воркеров"""
+        while True:
+            await asyncio.sleep(config.WORKER_STATS_INTERVAL)
+            for shard, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logger.error(f"Worker {shard} exited with code {process.exitcode}, restarting")
+                    self.restarts[shard] += 1
+                    self._spawn(shard)
+            self._collect_stats()
+            logger.info(f"Shard stats: {self.stats()}")
+
+    async def stop(self, timeout: float = 30.0):
+        """Остановка воркеров после обработки уже переданных им обновлений"""
+        loop = asyncio.get_running_loop()
+        for updates in self.queues:
+            await loop.run_in_executor(None, updates.put, None)
+        for process in self.processes:
+            if process is not None:
+                await loop.run_in_executor(None, process.join, timeout)
+                if process.is_alive():
+                    process.terminate()
+        self._collect_stats()
+        logger.info(f"Shard stats: {self.stats()}")
+
+    def stats(self) -> Dict[int, Dict]:
+        """Метрики по шардам"""
+        return {
+            shard: {
+                'dispatched': self.dispatched[shard],
+                'rejected': self.rejected[shard],
+                'queued': self._queue_size(shard),
+                'restarts': self.restarts[shard],
+                'worker': self.worker_stats.get(shard, {}),
+            }
+            for shard in range(self.workers)
+        }
+
+    def _queue_size(self, shard: int) -> int:
+        try:
+            return self.queues[shard].qsize()
+        except NotImplementedError:  # macOS
+            return -1
+
+
+async def poll_updates(bot: Bot, runtime: ShardedRuntime, allowed_updates: Sequence[str]):
+    """Long polling в родительском процессе: сырые обновления сразу уходят воркерам"""
+    url = bot.session.api.api_url(token=bot.token, method="getUpdates")
+    offset = None
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as session:
+        while True:
+            try:
+                async with session.post(url, json={
+                    'offset': offset, 'timeout': 30, 'allowed_updates': list(allowed_updates),
+                }) as response:
+                    payload = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"getUpdates failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not payload.get('ok'):
+                retry_after = payload.get('parameters', {}).get('retry_after', 1)
+                logger.warning(f"getUpdates error: {payload.get('description')}")
+                await asyncio.sleep(retry_after)
+                continue
+            for update in payload['result']:
+                await runtime.put(update)
+                offset = update['update_id'] + 1
+
+
+def make_sharded_webhook_app(runtime: ShardedRuntime) -> web.Application:
+    """Вебхук родительского процесса: проверка секрета и передача обновления воркеру"""
+    from webhook import check_secret_token
+
+    async def handle(request: web.Request) -> web.Response:
+        if not check_secret_token(request, config.WEBHOOK_SECRET):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        # Очередь воркера заполнена - Telegram повторит доставку позже
+        return web.Response(status=200 if runtime.dispatch(update) else 503)
+
+    app = web.Application()
+    app.router.add_post(config.WEBHOOK_PATH, handle)
+    return app
+
+
+async def run_sharded(bot: Bot, allowed_updates: Sequence[str], bot_username: str,
+                      workers: int = config.BOT_WORKERS):
+    """Приём обновлений и раздача их воркерам (до отмены задачи)"""
+    from webhook import start_webhook_site
+
+    runtime = ShardedRuntime(workers)
+    REGISTRY.add_collector("shards", lambda: stats_samples("bot_shard", runtime.stats(), "shard"))
+    runtime.start(bot_username)
+    monitor = asyncio.create_task(runtime.monitor())
+    runner = None
+    try:
+        if config.BOT_MODE == "webhook":
+            runner = await start_webhook_site(make_sharded_webhook_app(runtime), bot, allowed_updates)
+            await asyncio.Event().wait()
+        else:
+            await poll_updates(bot, runtime, allowed_updates)
+    finally:
+        monitor.cancel()
+        if runner is not None:
+            await runner.cleanup()
+        await runtime.stop()